@@ -0,0 +1,290 @@
+"""Squall benchmark suite.
+
+Runs on one machine and prints results as JSON, so runs of different
+commits can be compared::
+
+    python benchmarks/bench.py all --output before.json
+    python benchmarks/bench.py compare before.json after.json
+
+Benchmarks:
+    echo    throughput and latency percentiles of `sample/echo.py`
+    scgi    requests/sec and latency percentiles of the SCGI gateway
+            measured with the built-in SCGI load generator
+    timers  cost of scheduling, cancelling and firing dispatcher timers
+    memory  server memory of idle connections per socket
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import selectors
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'py'))
+
+
+def percentiles(samples):
+    """Latency percentiles in milliseconds."""
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    return {'p{}'.format(p): round(samples[min(len(samples) - 1, int(len(samples) * p / 100))] * 1000, 3)
+            for p in (50, 90, 99, 99.9)}
+
+
+def scgi_request(path='/', body=b''):
+    """Builds SCGI request."""
+    headers = (('CONTENT_LENGTH', str(len(body))), ('SCGI', '1'),
+               ('REQUEST_METHOD', 'GET'), ('REQUEST_URI', path))
+    header = b''.join(name.encode() + b'\0' + value.encode() + b'\0' for name, value in headers)
+    return str(len(header)).encode() + b':' + header + b',' + body
+
+
+class Server(object):
+    """Benchmarked server subprocess."""
+    def __init__(self, args, address):
+        env = dict(os.environ, PYTHONPATH=os.path.join(ROOT, 'py'))
+        self.process = subprocess.Popen([sys.executable] + args, cwd=ROOT, env=env)
+        self.address = address
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(address, 1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline or self.process.poll() is not None:
+                    self.close()
+                    raise RuntimeError("Cannot start server: {}".format(args))
+                time.sleep(0.05)
+
+    def rss(self):
+        """Resident memory of the server process in bytes."""
+        with open('/proc/{}/status'.format(self.process.pid)) as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+        return None
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+class LoadGenerator(object):
+    """Non-blocking load generator with the fixed number of concurrent connections.
+
+    With `persistent` every connection sends request after request, otherwise
+    each request has its own connection which is read until EOF.
+    """
+    def __init__(self, address, request, concurrency, duration, persistent):
+        self.address = address
+        self.request = request
+        self.concurrency = concurrency
+        self.duration = duration
+        self.persistent = persistent
+        self.selector = selectors.DefaultSelector()
+        self.latencies = list()
+        self.errors = 0
+
+    def _connect(self, sock=None):
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.connect_ex(self.address)
+            self.selector.register(sock, selectors.EVENT_WRITE, [time.perf_counter(), self.request, b''])
+        else:
+            self.selector.modify(sock, selectors.EVENT_WRITE, [time.perf_counter(), self.request, b''])
+
+    def _finish(self, sock, state, ok):
+        if ok:
+            self.latencies.append(time.perf_counter() - state[0])
+        else:
+            self.errors += 1
+        if self.persistent and ok and not self._stopping:
+            self._connect(sock)
+        else:
+            self.selector.unregister(sock)
+            sock.close()
+            if not self._stopping:
+                self._connect()
+
+    def run(self):
+        self._stopping = False
+        for _ in range(self.concurrency):
+            self._connect()
+        started_at = time.perf_counter()
+        while self.selector.get_map():
+            self._stopping = time.perf_counter() - started_at > self.duration
+            for key, events in self.selector.select(1.0):
+                sock, state = key.fileobj, key.data
+                try:
+                    if events & selectors.EVENT_WRITE:
+                        sent = sock.send(state[1])
+                        state[1] = state[1][sent:]
+                        if not state[1]:
+                            self.selector.modify(sock, selectors.EVENT_READ, state)
+                    elif events & selectors.EVENT_READ:
+                        received = sock.recv(65536)
+                        state[2] += received
+                        if self.persistent and len(state[2]) >= len(self.request):
+                            self._finish(sock, state, state[2] == self.request)
+                        elif not received:
+                            self._finish(sock, state, state[2].startswith(b'Status: 200'))
+                except OSError:
+                    self._finish(sock, state, False)
+        elapsed = time.perf_counter() - started_at
+        return {
+            'requests': len(self.latencies),
+            'errors': self.errors,
+            'seconds': round(elapsed, 3),
+            'rps': round(len(self.latencies) / elapsed, 1),
+            'latency_ms': percentiles(self.latencies),
+        }
+
+
+def bench_echo(options):
+    message = b'x' * (options.size - 1) + b'\n'
+    server = Server(['sample/echo.py'], ('127.0.0.1', 2007))
+    try:
+        result = LoadGenerator(server.address, message, options.concurrency,
+                               options.duration, True).run()
+    finally:
+        server.close()
+    result['message_size'] = len(message)
+    result['mbytes_per_second'] = round(result['rps'] * len(message) * 2 / 1e6, 3)
+    return result
+
+
+def bench_scgi(options):
+    args = ['benchmarks/scgi_server.py', str(options.port)]
+    if options.workers:
+        args.append(str(options.workers))
+    server = Server(args, ('127.0.0.1', options.port))
+    try:
+        return LoadGenerator(server.address, scgi_request(), options.concurrency,
+                             options.duration, False).run()
+    finally:
+        server.close()
+
+
+def bench_timers(options):
+    from squall.dispatcher import dispatcher
+    result = dict()
+    for number in options.timers:
+        callback = lambda revents: None
+        started_at = time.perf_counter()
+        timers = [dispatcher.watch(callback, timeout=0.001 + n % 1000 * 1e-6) for n in range(number)]
+        scheduled_at = time.perf_counter()
+        for timer in timers[::2]:
+            dispatcher.cancel(timer)
+        cancelled_at = time.perf_counter()
+        dispatcher.start()
+        finished_at = time.perf_counter()
+        result[str(number)] = {
+            'schedule_us': round((scheduled_at - started_at) / number * 1e6, 3),
+            'cancel_us': round((cancelled_at - scheduled_at) / (number // 2) * 1e6, 3),
+            'fire_us': round((finished_at - cancelled_at) / (number - number // 2) * 1e6, 3),
+        }
+    return result
+
+
+def bench_memory(options):
+    server = Server(['sample/echo.py'], ('127.0.0.1', 2007))
+    sockets = list()
+    try:
+        time.sleep(0.2)
+        before = server.rss()
+        for _ in range(options.connections):
+            sockets.append(socket.create_connection(server.address))
+        # let the server accept all connections and start their coroutines
+        for sock in sockets[-16:]:
+            sock.sendall(b'ping\n')
+            sock.recv(16)
+        time.sleep(0.5)
+        after = server.rss()
+    finally:
+        for sock in sockets:
+            sock.close()
+        server.close()
+    return {
+        'connections': options.connections,
+        'rss_before': before,
+        'rss_after': after,
+        'bytes_per_connection': (after - before) // options.connections,
+    }
+
+
+BENCHMARKS = {
+    'echo': bench_echo,
+    'scgi': bench_scgi,
+    'timers': bench_timers,
+    'memory': bench_memory,
+}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before, after):
+    """Prints relative changes of numeric results of two runs."""
+    def walk(old, new, path):
+        if isinstance(old, dict) and isinstance(new, dict):
+            for key in old:
+                if key in new:
+                    walk(old[key], new[key], path + (key,))
+        elif isinstance(old, (int, float)) and isinstance(new, (int, float)) and old:
+            print("{:<50} {:>14} {:>14} {:>+8.1f}%".format(
+                '.'.join(path), old, new, (new - old) / old * 100))
+    walk(before['results'], after['results'], ())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Squall benchmark suite.")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS) + ['all', 'compare'])
+    parser.add_argument('files', nargs='*', help="two result files to compare")
+    parser.add_argument('--output', help="write JSON results to file")
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--size', type=int, default=64, help="echo message size")
+    parser.add_argument('--port', type=int, default=7000, help="SCGI server port")
+    parser.add_argument('--workers', type=int, default=None, help="SCGI server worker processes")
+    parser.add_argument('--connections', type=int, default=1000, help="idle connections of memory benchmark")
+    parser.add_argument('--timers', type=int, nargs='+', default=[10000, 100000, 1000000])
+    options = parser.parse_args(argv)
+
+    if options.benchmark == 'compare':
+        if len(options.files) != 2:
+            parser.error("compare requires two result files")
+        with open(options.files[0]) as before, open(options.files[1]) as after:
+            compare(json.load(before), json.load(after))
+        return
+
+    names = sorted(BENCHMARKS) if options.benchmark == 'all' else [options.benchmark]
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'options': {name: value for name, value in vars(options).items()
+                    if name not in ('benchmark', 'files', 'output')},
+        'results': {name: BENCHMARKS[name](options) for name in names},
+    }
+    output = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, 'w') as file:
+            file.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+"""SCGI server of the benchmark suite, serves a tiny JSON endpoint."""
+import sys
+import squall
+from squall.scgi2wsgi import wsgi
+
+BODY = b'{"status": "ok"}'
+
+
+def application(environ, start_response):
+    start_response("200 OK", [("Content-Type", "application/json"),
+                              ("Content-Length", str(len(BODY)))])
+    return [BODY]
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 7000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    squall.streamServer(wsgi(application), ("127.0.0.1", port), 1024)
+    squall.start(workers)
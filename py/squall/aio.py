@@ -0,0 +1,159 @@
+"""`squall.aio`"""
+import asyncio
+from time import monotonic as now
+from squall.dispatcher import dispatcher
+from squall.coroutine import coroutine
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+
+class Driver(object):
+    """Drives the squall dispatcher from an asyncio event loop.
+
+    The epoll fd of the dispatcher is watched as an asyncio reader and
+    every step performs one non-blocking dispatcher loop, the next step
+    is scheduled for pending idle callbacks or the nearest deadline.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self._fd = None
+        self._step_at = None
+        self._step_handle = None
+        self._waiting = 0
+        self.finished = loop.create_future()
+
+    def start(self):
+        """Attaches the dispatcher to the loop."""
+        self._fd = dispatcher.fileno()
+        self.loop.add_reader(self._fd, self.wakeup)
+        dispatcher._started = True
+        self.wakeup()
+        return self.finished
+
+    def stop(self):
+        """Detaches the dispatcher from the loop."""
+        if self._fd is not None:
+            self.loop.remove_reader(self._fd)
+            self._fd = None
+        if self._step_handle is not None:
+            self._step_handle.cancel()
+            self._step_handle = None
+        dispatcher._started = False
+        if not self.finished.done():
+            self.finished.set_result(None)
+
+    def wakeup(self):
+        """Schedules the dispatcher step as soon as possible."""
+        self._schedule(0)
+
+    def _schedule(self, delay):
+        step_at = self.loop.time() + delay
+        if self._step_handle is not None:
+            if self._step_at <= step_at:
+                return
+            self._step_handle.cancel()
+        self._step_at = step_at
+        self._step_handle = self.loop.call_at(step_at, self._step)
+
+    def _step(self):
+        self._step_handle = None
+        dispatcher.loop(block=False)
+        if not dispatcher._started or not (dispatcher.active or self._waiting):
+            self.stop()
+        elif dispatcher.queued:
+            self._schedule(0)
+        else:
+            deadline = dispatcher._next_deadline()
+            if deadline is not None:
+                delay = deadline - now()
+                self._schedule(delay if delay > 0 else 0)
+
+
+_driver = None
+
+
+def serve(loop=None):
+    """Runs the squall dispatcher on the asyncio loop, returns the future done when it has finished.
+
+    Call it again after squall coroutines are started from asyncio code.
+    """
+    global _driver
+    loop = loop or asyncio.get_event_loop()
+    if _driver is None or _driver.loop is not loop or _driver.finished.done():
+        _driver = Driver(loop)
+        _driver.start()
+    else:
+        _driver.wakeup()
+    return _driver.finished
+
+
+def new_event_loop():
+    """Creates new event loop, uvloop if it is installed."""
+    return uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
+
+
+def run(main=None):
+    """Runs squall coroutines and the asyncio awaitable on a new event loop.
+
+    Returns result of main if it is given, otherwise runs until the dispatcher has finished.
+    """
+    loop = new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        finished = serve(loop)
+        return loop.run_until_complete(main if main is not None else finished)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        _driver.stop()
+        for handle in coroutine.all:
+            coroutine.throw(handle, GeneratorExit)
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def future(handle, loop=None):
+    """Returns asyncio future of the result of squall coroutine with given handle."""
+    loop = loop or asyncio.get_event_loop()
+    result_future = loop.create_future()
+
+    def done(result, exception):
+        if result_future.done():
+            return
+        if isinstance(exception, GeneratorExit):
+            result_future.cancel()
+        elif exception is not None:
+            result_future.set_exception(exception)
+        else:
+            result_future.set_result(result)
+    coroutine.notify(handle, done)
+    return result_future
+
+
+def wait(awaitable, timeout=None):
+    """Pauses current coroutine until asyncio awaitable is done, returns its result."""
+    assert coroutine.current is not None, "Can called only from coroutine."
+    assert _driver is not None and not _driver.finished.done(), "Dispatcher is not served by asyncio."
+    driver = _driver
+    handle = coroutine.current
+    awaited = asyncio.ensure_future(awaitable, loop=driver.loop)
+    if timeout is not None:
+        awaited = asyncio.ensure_future(asyncio.wait_for(awaited, timeout), loop=driver.loop)
+
+    def resume(awaited):
+        driver._waiting -= 1
+        if handle in coroutine._all:
+            coroutine.switch(handle, None)
+        driver.wakeup()
+    driver._waiting += 1
+    awaited.add_done_callback(resume)
+    try:
+        yield
+    except GeneratorExit:
+        awaited.cancel()
+        raise
+    return awaited.result()
@@ -0,0 +1,125 @@
+"""`squall.cache`"""
+import functools
+from collections import OrderedDict
+from time import monotonic as now
+from squall.dispatcher import dispatcher
+from squall.coroutine import coroutine
+
+
+class ResponseCache(object):
+    """In-process LRU cache of pre-serialized WSGI responses.
+
+    Responses of the GET and HEAD requests are keyed on method, path,
+    query and the vary environ keys, kept for max-age of Cache-Control
+    or given ttl, and evicted least recently used above max_size bytes.
+    """
+    cacheable_status = ('200', '203', '301', '404')
+
+    def __init__(self, max_size=64*1024*1024, ttl=None, vary=(), max_entry_size=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.vary = tuple(vary)
+        self.max_entry_size = max_entry_size or max_size // 8
+        self.size = 0
+        self.hits = self.misses = self.collapsed = 0
+        self._entries = OrderedDict()
+        self._pending = dict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, environ):
+        """Returns cache key of request or None if it is not cacheable."""
+        method = environ.get('REQUEST_METHOD')
+        if method not in ('GET', 'HEAD'):
+            return None
+        if 'no-cache' in environ.get('HTTP_CACHE_CONTROL', ''):
+            return None
+        return (method, environ.get('PATH_INFO', ''), environ.get('QUERY_STRING', '')) + \
+            tuple(environ.get(name, '') for name in self.vary)
+
+    def get(self, key):
+        """Returns stored response bytes or None."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[1] > now():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self._remove(key)
+        self.misses += 1
+        return None
+
+    def put(self, key, headers, data):
+        """Stores response data if headers allow it; returns True if stored."""
+        ttl = self._ttl(headers)
+        if not ttl or len(data) > self.max_entry_size:
+            return False
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (data, now() + ttl)
+        self.size += len(data)
+        while self.size > self.max_size:
+            self._remove(next(iter(self._entries)))
+        return True
+
+    def invalidate(self, key=None):
+        """Drops the cached response of key or all of them."""
+        if key is None:
+            self._entries.clear()
+            self.size = 0
+        elif key in self._entries:
+            self._remove(key)
+
+    def _remove(self, key):
+        data, _ = self._entries.pop(key)
+        self.size -= len(data)
+
+    def _ttl(self, headers):
+        status = headers[0][1][:3] if headers else None
+        if status not in self.cacheable_status:
+            return None
+        ttl = self.ttl
+        for name, value in headers[1:]:
+            name = name.lower()
+            if name == 'set-cookie':
+                return None
+            elif name == 'vary':
+                for field in value.split(','):
+                    field = 'HTTP_' + field.strip().upper().replace('-', '_')
+                    if field not in self.vary:
+                        return None
+            elif name == 'cache-control':
+                for directive in value.lower().split(','):
+                    directive, _, argument = directive.strip().partition('=')
+                    if directive in ('no-store', 'no-cache', 'private'):
+                        return None
+                    if directive in ('max-age', 's-maxage'):
+                        try:
+                            ttl = int(argument.strip('"'))
+                        except ValueError:
+                            return None
+        return ttl
+
+    def _lead(self, key):
+        # the current coroutine computes the response of key, others wait for it
+        self._pending[key] = list()
+
+    def _wait(self, key):
+        # parks current coroutine until the leader has done; returns data or None
+        waiter = [coroutine.current]
+        self._pending[key].append(waiter)
+        self.collapsed += 1
+        try:
+            return (yield)
+        except:
+            waiter[0] = None
+            raise
+
+    def _done(self, key, data):
+        for waiter in self._pending.pop(key, ()):
+            dispatcher.call(functools.partial(self._handover, waiter, data))
+
+    def _handover(self, waiter, data, revents):
+        if waiter[0] is not None:
+            coroutine.switch(waiter[0], data)
@@ -1,9 +1,14 @@
 """`squall.coroutine`"""
 import functools
+from itertools import count
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from squall import process
 from squall.utilites import log
+from squall.prefork import Supervisor
 from squall.dispatcher import dispatcher
 from squall.dispatcher import READ, WRITE, TIMEOUT, IDLE
+from squall.dispatcher import LOW
 
 
 class CoroAPI(type):
@@ -11,6 +16,10 @@ class CoroAPI(type):
     def __init__(cls, *args):
         cls._all = dict()
         cls._current = deque()
+        cls._handles = count(1)
+        cls._executor = None
+        cls._process_executor = None
+        cls._profiler = None
         super(CoroAPI, cls).__init__(*args)
 
     @property
@@ -21,45 +30,132 @@ class CoroAPI(type):
     @property
     def current(cls):
         """Handle of current coroutine."""
-        return id(cls._current[0]) if len(cls._current) else None
+        return cls._current[0].handle if len(cls._current) else None
+
+    @property
+    def context(cls):
+        """Context of current coroutine."""
+        return cls._current[0] if len(cls._current) else None
+
+    def _context(cls, handle):
+        try:
+            return cls._all[handle]
+        except KeyError:
+            raise ValueError("Cannot found coroutine for given handle.") from None
 
     @property
     def dispatcher(cls):
         """Event dispatcher."""
         return dispatcher
 
-    def sleep(cls, timeout=None):
-        """Pauses current coroutine until timeout is not expired."""
+    @property
+    def executor(cls):
+        """Thread pool executor of `run_in_executor`."""
+        if cls._executor is None:
+            cls._executor = ThreadPoolExecutor(thread_name_prefix='squall')
+        return cls._executor
+
+    @executor.setter
+    def executor(cls, value):
+        cls._executor = value
+
+    @property
+    def process_executor(cls):
+        """Persistent process pool executor of `run_in_process`."""
+        if cls._process_executor is None:
+            cls._process_executor = process.executor()
+        return cls._process_executor
+
+    @process_executor.setter
+    def process_executor(cls, value):
+        cls._process_executor = value
+
+    def sleep(cls, timeout=None, priority=LOW):
+        """Pauses current coroutine until timeout is not expired.
+
+        Without timeout it yields to other coroutines, resumed in given priority class.
+        """
         # callback resume coroutine and sent to it revents
         def resume(handle, revents):
-            coroutine.switch(handle, revents)
+            # the coroutine might have been terminated meanwhile
+            if handle in coroutine._all:
+                coroutine.switch(handle, revents)
         assert cls.current is not None, "Can called only from coroutine."
         callback = functools.partial(resume, coroutine.current)
         timeout = timeout or 0
         if timeout > 0:
             dispatcher.watch(callback, timeout=timeout)
         else:
-            dispatcher.call(callback)
+            dispatcher.call(callback, priority)
         return (yield)
 
     def wait(cls, fd, eventmask, timeout=None):
         """Pauses current coroutine until event is not occurred."""
         # callback resume coroutine and sent to it revents
         def resume(handle, revents):
-            coroutine.switch(handle, revents)
+            # the coroutine might have been terminated meanwhile
+            if handle in coroutine._all:
+                coroutine.switch(handle, revents)
         assert cls.current is not None, "Can called only from coroutine."
         callback = functools.partial(resume, coroutine.current)
         dispatcher.watch(callback, fd, eventmask, timeout or 0)
         return (yield)
 
+    def run_in_executor(cls, fn, *args):
+        """Pauses current coroutine until fn called in the thread pool has returned."""
+        assert cls.current is not None, "Can called only from coroutine."
+        return (yield from cls.wait_future(cls.executor.submit(fn, *args)))
+
+    def run_in_process(cls, fn, *args):
+        """Pauses current coroutine until fn called in the process pool has returned.
+
+        Buffers larger than `process.SHARED_THRESHOLD` pass through shared memory,
+        such args come to fn as read-only memoryviews; fn must be picklable.
+        """
+        assert cls.current is not None, "Can called only from coroutine."
+        args, segments = process.share(args)
+        try:
+            future = cls.process_executor.submit(process.call, fn, args)
+            try:
+                result = yield from cls.wait_future(future)
+            except GeneratorExit:
+                # a shared result of the abandoned call is freed when it comes
+                future.add_done_callback(process.discard)
+                raise
+        finally:
+            process.release(segments)
+        return process.receive(result)
+
+    def wait_future(cls, future):
+        """Pauses current coroutine until the concurrent future is done; returns its result."""
+        # callback resume coroutine and sent to it the done future
+        def resume(handle, future):
+            if handle in coroutine._all:
+                coroutine.switch(handle, future)
+        assert cls.current is not None, "Can called only from coroutine."
+        dispatcher.complete(functools.partial(resume, coroutine.current), future)
+        try:
+            yield
+        except GeneratorExit:
+            future.cancel()
+            raise
+        return future.result()
+
+    def notify(cls, handle, callback):
+        """Setups callback called with (result, exception) when coroutine has terminated."""
+        context = cls._context(handle)
+        if context.done is None:
+            context.done = list()
+        context.done.append(callback)
+
     def switch(cls, handle, value):
         """Switches to coroutine by handle and send value."""
-        with context(handle) as corogen:
+        with cls._context(handle) as corogen:
             corogen.send(value)
 
     def throw(cls, handle, exception):
         """Switches to coroutine by handle and raise given exception."""
-        with context(handle) as corogen:
+        with cls._context(handle) as corogen:
             corogen.throw(exception)
 
 
@@ -76,46 +172,64 @@ class coroutine(metaclass=CoroAPI):
         # calback starts coroutine
         def start(handle, revents):
             assert revents == IDLE
-            with context(handle) as corogen:
+            with coroutine._context(handle) as corogen:
                 log.debug("Coroutine with handle: {:X} has started.".format(handle))
                 next(corogen)
         run = functools.partial(self._run, self._obj) if self._obj else self._run
         corogen = run(*args, **kwargs)
-        handle = id(corogen)
-        coroutine._all[handle] = corogen
+        # handles are never reused, unlike id() of freed generators
+        handle = next(coroutine._handles)
+        coroutine._all[handle] = context(handle, corogen)
         dispatcher.call(functools.partial(start, handle))
         return handle
 
 
 class context(object):
-    """Current coroutine context."""
-    def __init__(self, handle):
-        if handle in coroutine._all:
-            self.corogen = coroutine._all[handle]
-        else:
-            raise ValueError("Cannot found coroutine for given handle.")
+    """Coroutine context, holds the generator and per-coroutine state of stream and gateway."""
+    __slots__ = ('handle', 'corogen', 'stream', 'gateway', 'done')
+
+    def __init__(self, handle, corogen):
+        self.handle = handle
+        self.corogen = corogen
+        self.stream = None
+        self.gateway = None
+        self.done = None
 
     def __enter__(self):
-        coroutine._current.appendleft(self.corogen)
+        coroutine._current.appendleft(self)
+        if coroutine._profiler is not None:
+            coroutine._profiler.enter(self)
         return self.corogen
 
     def __exit__(self, type, value, traceback):
-        handle = coroutine.current
+        handle = self.handle
         coroutine._current.popleft()
+        if coroutine._profiler is not None:
+            coroutine._profiler.exit(self, type is not None)
         if type is not None:
+            result = exception = None
             if type == StopIteration or type == GeneratorExit:
                 log.debug("Coroutine with handle: {:X} has terminated.".format(handle))
+                if type == StopIteration:
+                    result = getattr(value, 'value', None)
+                else:
+                    exception = value
             else:
+                exception = value
                 try:
                     raise value.with_traceback(traceback)
                 except:
                     log.exception("Coroutine with handle: {:X} has terminated because uncaught exception:".format(handle))
             del coroutine._all[handle]
+            for callback in self.done or ():
+                callback(result, exception)
         return True
 
 
-def start():
-    """Starts event dispatching."""
+def start(workers=None):
+    """Starts event dispatching, in given number of worker processes if set."""
+    if workers:
+        return Supervisor(workers, start).start()
     try:
         dispatcher.start()
     except KeyboardInterrupt:
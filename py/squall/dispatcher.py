@@ -1,10 +1,12 @@
 """`squall.dispatcher`"""
 
+import os
 import select
 import functools
+from itertools import count
 from collections import deque
-from time import time as now
-from heapq import heappush, heappop
+from time import monotonic as now
+from heapq import heappush, heappop, heapify
 from squall.utilites import Singleton
 
 
@@ -13,6 +15,8 @@ class Poll(object):
     READ = select.EPOLLIN                      # 0b0000000000000001
     WRITE = select.EPOLLOUT                    # 0b0000000000000100
     ERROR = select.EPOLLERR | select.EPOLLHUP  # 0b0000000000011000
+    ONESHOT = select.EPOLLONESHOT
+    EDGE = select.EPOLLET
 
     def __init__(self):
         self._impl = select.epoll()
@@ -20,12 +24,54 @@ class Poll(object):
     def register(self, fd, eventmask):
         return self._impl.register(fd, eventmask)
 
+    def modify(self, fd, eventmask):
+        return self._impl.modify(fd, eventmask)
+
     def unregister(self, fd):
         return self._impl.unregister(fd)
 
     def poll(self, timeout):
         return self._impl.poll(timeout)
 
+    def close(self):
+        return self._impl.close()
+
+    def fileno(self):
+        return self._impl.fileno()
+
+
+class Waker(object):
+    """Wakes up the poll from other threads with eventfd or self-pipe."""
+    def __init__(self):
+        if hasattr(os, 'eventfd'):
+            self._rfd = self._wfd = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+            self._signal = (1).to_bytes(8, 'little')
+        else:
+            self._rfd, self._wfd = os.pipe()
+            os.set_blocking(self._rfd, False)
+            os.set_blocking(self._wfd, False)
+            self._signal = b'\x01'
+
+    def fileno(self):
+        return self._rfd
+
+    def wakeup(self):
+        try:
+            os.write(self._wfd, self._signal)
+        except BlockingIOError:
+            pass
+
+    def drain(self):
+        try:
+            os.read(self._rfd, 4096)
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        os.close(self._rfd)
+        if self._wfd != self._rfd:
+            os.close(self._wfd)
+
 
 READ = Poll.READ
 WRITE = Poll.WRITE
@@ -34,78 +80,282 @@ TIMEOUT = 0x20
 IDLE = 0x40
 CLEANUP = 0x80
 
+# priority classes of idle callbacks
+HIGH = 0    # I/O completions and listeners
+NORMAL = 1  # coroutine starts and wakeups
+LOW = 2     # CPU yielding coroutines
+
 
 class Dispatcher(metaclass=Singleton):
-    """The event dispatcher."""
+    """The event dispatcher.
+
+    Idle callbacks run in order of priority classes, an iteration runs up
+    to callback_budget of them or for time_budget seconds before polling,
+    but at least min_share of every class, so lower ones are not starved.
+    """
+    callback_budget = 256
+    time_budget = 0.005
+    min_share = 4
 
     def __init__(self):
         self._poll = Poll()
         self._started = False
-        self._idles = deque()
+        self._queues = (deque(), deque(), deque())
         self._pending = dict()
         self._timeouts = list()
+        self._cancelled = 0
+        self._sequence = count()
+        self._registered = dict()
+        self._ready = dict()
+        self._threadsafe = deque()
+        self._outstanding = 0
+        self._stats = None
+        self._waker = Waker()
+        self._poll.register(self._waker.fileno(), READ)
+
+    def reinit(self):
+        """Recreates the poll object; call it in a forked child process."""
+        self._poll.close()
+        self._poll = Poll()
+        self._waker.close()
+        self._waker = Waker()
+        self._poll.register(self._waker.fileno(), READ)
+        registered = self._registered
+        self._registered = dict()
+        self._ready = dict()
+        for fd, tracked in registered.items():
+            if tracked:
+                self.track(fd)
+        for fd, (callback, timer, eventmask) in self._pending.items():
+            if not registered.get(fd):
+                self._arm(fd, eventmask)
+
+    def fileno(self):
+        """Returns fd of the poll object, it is readable while any event is pending."""
+        return self._poll.fileno()
+
+    @property
+    def active(self):
+        """True while there are callbacks, watchers or timers to dispatch."""
+        return bool(len(self._timeouts) > self._cancelled or self.queued
+                    or len(self._pending) or self._outstanding)
+
+    @property
+    def queued(self):
+        """Number of queued idle callbacks."""
+        high, normal, low = self._queues
+        return len(high) + len(normal) + len(low)
+
+    def call(self, callback, priority=NORMAL):
+        """Setups the next idle callback of given priority class."""
+        self._queues[priority].append(callback)
+
+    def call_threadsafe(self, callback):
+        """Setups the next idle callback from any thread."""
+        self._threadsafe.append(callback)
+        if len(self._threadsafe) == 1:
+            # otherwise the waker has been signalled and not drained yet
+            self._waker.wakeup()
 
-    def call(self, callback, not_once=False):
-        """Setups the next idle callback."""
-        self._idles.append(callback)
+    def complete(self, callback, future):
+        """Setups callback called with the concurrent future when it is done."""
+        def completed(revents):
+            self._outstanding -= 1
+            callback(future)
+        self._outstanding += 1
+        future.add_done_callback(lambda future: self.call_threadsafe(completed))
+
+    def track(self, fd):
+        """Registers fd once for the edge-triggered readiness tracking.
+
+        A tracked fd stays registered until `release` is called, a waiting
+        is served from the tracked readiness without any epoll_ctl syscall.
+        An owner of a tracked fd must do I/O until EAGAIN before it waits.
+        """
+        if self._registered.get(fd):
+            return
+        eventmask = READ | WRITE | Poll.EDGE
+        if fd in self._registered:
+            try:
+                self._poll.modify(fd, eventmask)
+            except FileNotFoundError:
+                # fd was closed without release and its number is reused
+                self._poll.register(fd, eventmask)
+        else:
+            self._poll.register(fd, eventmask)
+        self._registered[fd] = True
+        self._ready[fd] = 0
+
+    def unwatch(self, fd):
+        """Drops pending watcher of fd; returns True if there was one."""
+        pending = self._pending.pop(fd, None)
+        if pending is None:
+            return False
+        if pending[1] is not None:
+            self.cancel(pending[1])
+        return True
+
+    def release(self, fd):
+        """Drops registration and pending watcher of fd; call it before closing fd."""
+        self.unwatch(fd)
+        if fd in self._registered:
+            del self._registered[fd]
+            self._ready.pop(fd, None)
+            try:
+                self._poll.unregister(fd)
+            except OSError:
+                pass
+
+    def _arm(self, fd, eventmask):
+        # one-shot registration stays in the epoll set after the event,
+        # so the next waiting of the same fd rearms it with a single syscall
+        eventmask |= Poll.ONESHOT
+        if fd in self._registered:
+            try:
+                self._poll.modify(fd, eventmask)
+            except FileNotFoundError:
+                # fd was closed without release and its number is reused
+                self._poll.register(fd, eventmask)
+        else:
+            try:
+                self._poll.register(fd, eventmask)
+            except FileExistsError:
+                self._poll.modify(fd, eventmask)
+            self._registered[fd] = False
 
     def watch(self, callback, fd=None, eventmask=None, timeout=None):
-        """Setups the event watcher."""
+        """Setups the event watcher, returns its timer if timeout is given."""
         assert (fd is not None and eventmask is not None) or timeout is not None
-        deadline = now() + timeout if timeout > 0 else None
-        if deadline is not None:
-            heappush(self._timeouts, (deadline, fd, callback))
+        timer = None
         if fd is not None:
-            self._poll.register(fd, eventmask)
-            self._pending[fd] = (callback, deadline)
-
-    def loop(self):
-        """Performs one event loop."""
-        # process idle callbacks
-        idles = deque(self._idles)
-        self._idles.clear()
-        while len(idles):
-            callback = idles.popleft()
-            callback(IDLE)
+            if self._registered.get(fd):
+                ready = self._ready[fd] & (eventmask | ERROR)
+                if ready:
+                    self._ready[fd] &= ~eventmask
+                    self._queues[HIGH].append(lambda revents: callback(ready))
+                    return
+            else:
+                self._arm(fd, eventmask)
+            if fd in self._pending and self._pending[fd][1] is not None:
+                self.cancel(self._pending[fd][1])
+        if timeout and timeout > 0:
+            # heap entry: [deadline, sequence, callback, fd]
+            timer = [now() + timeout, next(self._sequence), callback, fd]
+            heappush(self._timeouts, timer)
+        if fd is not None:
+            self._pending[fd] = (callback, timer, eventmask)
+        return timer
+
+    def cancel(self, timer):
+        """Cancels the timer; its heap entry is dropped lazily."""
+        if timer[2] is not None:
+            timer[2] = None
+            if timer[1] is not None:
+                # counted only while the entry is still in the heap
+                self._cancelled += 1
+            if self._cancelled > 256 and self._cancelled > len(self._timeouts) // 2:
+                self._timeouts = [timer for timer in self._timeouts if timer[2] is not None]
+                heapify(self._timeouts)
+                self._cancelled = 0
+
+    def _next_deadline(self):
+        while len(self._timeouts):
+            if self._timeouts[0][2] is not None:
+                return self._timeouts[0][0]
+            heappop(self._timeouts)
+            self._cancelled -= 1
+        return None
+
+    def _expired(self):
+        expired = list()
+        current = now()
+        while len(self._timeouts) and self._timeouts[0][0] <= current:
+            timer = heappop(self._timeouts)
+            if timer[2] is not None:
+                # marks the entry as popped, see `cancel`
+                timer[1] = None
+                expired.append(timer)
+            else:
+                self._cancelled -= 1
+        return expired
+
+    def loop(self, block=True):
+        """Performs one event loop, polls without waiting unless block."""
+        stats = self._stats
+        if stats is not None:
+            stats.begin(self.queued)
+        # process idle callbacks queued before this iteration within the budgets
+        budget, min_share = self.callback_budget, self.min_share
+        deadline = now() + self.time_budget
+        executed = 0
+        # lengths are taken at once, so lower classes do not run callbacks queued by higher ones
+        lengths = [len(queue) for queue in self._queues]
+        for queue, length in zip(self._queues, lengths):
+            for index in range(length):
+                if index >= min_share and (executed >= budget or not executed & 15 and now() > deadline):
+                    break
+                queue.popleft()(IDLE)
+                executed += 1
         # polling
-        if len(self._timeouts):
-            deadline, _a, _b = heappop(self._timeouts)
-            heappush(self._timeouts, (deadline, _a, _b))
-        else:
-            deadline = None
+        deadline = self._next_deadline()
         timeout = deadline - now() if deadline is not None else 3600.0
         timeout = timeout if timeout > 0 else 0
+        if not block or self.queued or not (len(self._pending) or deadline is not None):
+            timeout = 0
 
+        if stats is not None:
+            stats.polling(executed, len(self._pending), len(self._timeouts) - self._cancelled)
         polled = self._poll.poll(timeout)
+        if stats is not None:
+            stats.polled(len(polled))
         # process polled
-        for fd, eventmask in polled:
-            callback, deadline = self._pending.pop(fd)
-            if deadline is not None:
-                self._timeouts.remove((deadline, fd, callback))
-            self._poll.unregister(fd)
-            callback(eventmask)
-        # process timed out
-        while len(self._timeouts):
-            deadline, fd, callback = heappop(self._timeouts)
-            if deadline < now():
-                if fd is not None:
-                    self._pending.pop(fd)
-                    self._poll.unregister(fd)
-                callback(TIMEOUT)
-            else:
-                heappush(self._timeouts, (deadline, fd, callback))
-                break
+        for fd, revents in polled:
+            if fd == self._waker.fileno():
+                self._waker.drain()
+                while len(self._threadsafe):
+                    self._threadsafe.popleft()(IDLE)
+                continue
+            pending = self._pending.get(fd)
+            if self._registered.get(fd):
+                ready = self._ready[fd] | revents
+                if pending is None or not ready & (pending[2] | ERROR):
+                    self._ready[fd] = ready
+                    continue
+                revents = ready & (pending[2] | ERROR)
+                self._ready[fd] = ready & ~pending[2]
+            elif pending is None:
+                # stale event of a watcher that has been timed out
+                continue
+            callback, timer, _ = self._pending.pop(fd)
+            if timer is not None:
+                self.cancel(timer)
+            callback(revents)
+        # process timed out, all expired in this tick at once
+        expired = self._expired()
+        for timer in expired:
+            callback, fd = timer[2], timer[3]
+            if callback is None:
+                # cancelled by one of previous callbacks of this batch
+                continue
+            timer[2] = None
+            if fd is not None:
+                self._pending.pop(fd)
+            callback(TIMEOUT)
+        if stats is not None:
+            stats.end(len(expired))
 
     def start(self):
         """Starts the event loop."""
         self._started = True
-        while self._started and (len(self._timeouts) or len(self._idles) or len(self._pending)):
+        while self._started and self.active:
             self.loop()
         self._started = False
 
     def stop(self):
         """Stops the event loop."""
         self._started = False
+        # the current iteration must not block in polling
+        self._waker.wakeup()
 
 
 # Default dispatcher
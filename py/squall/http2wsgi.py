@@ -0,0 +1,289 @@
+"""`squall.http2wsgi`"""
+import functools
+from urllib.parse import unquote_to_bytes
+from squall.network import stream
+from squall.coroutine import coroutine
+from squall.utilites import log, timeout_gen
+from squall.scgi2wsgi import Gateway, GatewayState, InputStream, FileWrapper
+
+
+class ChunkedInputStream(InputStream):
+    """WSGI input stream adapter for the chunked request body."""
+    def __init__(self, environ, timeout):
+        super(ChunkedInputStream, self).__init__(environ, timeout)
+        self._loaded = False
+
+    def _async_body_loader(self, callback=None):
+        received = 0
+        callback = callback or (lambda current, total: True)
+        try:
+            while True:
+                line = yield from stream.readLine(1024, next(self._timeout))
+                if not line.endswith(b'\n'):
+                    raise ValueError("Wrong chunk size line")
+                remained = int(line.split(b';')[0].strip(), 16)
+                if remained == 0:
+                    # skip trailers
+                    while (yield from stream.readLine(8*1024, next(self._timeout))).strip():
+                        pass
+                    break
+                while remained > 0:
+                    block_size = stream.chunk_size if stream.chunk_size < remained else remained
+                    data = yield from stream.read(block_size, next(self._timeout))
+                    if not data:
+                        raise ValueError("Unexpected end of chunked body")
+                    remained -= len(data)
+                    received += len(data)
+                    if callback(received, None):
+                        self._append(data)
+                yield from stream.read(2, next(self._timeout))
+        except BaseException as exc:
+            self._finish(ConnectionError("Cannot receive request body: {!r}".format(exc)))
+            raise
+        stream.setDeadline(None)
+        self._finish()
+
+
+class HTTPGatewayState(GatewayState):
+    """State of a HTTP gateway request."""
+    __slots__ = ('keep_alive', 'chunked', 'request')
+
+    def __init__(self, chunk_size, buffer_size):
+        super(HTTPGatewayState, self).__init__(chunk_size, buffer_size)
+        self.keep_alive = False
+        self.chunked = False
+        self.request = None
+
+
+class HTTPGateway(Gateway):
+    """HTTP2WSGI Gateway API hub"""
+    _state_class = HTTPGatewayState
+
+    @property
+    def _keep_alive(cls):
+        instance = cls._instance
+        return instance.keep_alive if instance is not None else None
+
+    @property
+    def _default_environ(cls):
+        return {
+            'wsgi.version': (1, 0),
+            'wsgi.multithread': False,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+            'wsgi.file_wrapper': FileWrapper,
+            'SCRIPT_NAME': '',
+        }
+
+    def _read_environ(cls, address, input_async, timeout, keepalive_timeout, max_header_size,
+                      header_timeout=None, body_timeout=None):
+        # an idle connection waits for the next request with keepalive_timeout
+        if header_timeout is not None:
+            connection = stream._instance
+            if not len(connection.in_buffer) and not connection.eof:
+                # the header budget starts with the first byte of the request
+                yield from stream._fill_in_buff(connection, timeout_gen(keepalive_timeout))
+                if connection.eof:
+                    # the client has closed the idle connection
+                    return None
+            stream.setDeadline(header_timeout)
+        data = yield from stream.readUntil(b'\r\n\r\n', max_header_size, keepalive_timeout)
+        if not data.strip() or (stream.EOF and not data.endswith(b'\r\n\r\n')):
+            return None
+        if not data.endswith(b'\r\n\r\n'):
+            raise ValueError("Request header is too large or incomplete")
+        timeout = timeout_gen(timeout)
+        lines = data.decode('iso-8859-1').split('\r\n')
+        method, uri, protocol = lines[0].split(' ')
+        if not protocol.startswith('HTTP/1.'):
+            raise ValueError("Unsupported protocol: {}".format(protocol))
+        environ = cls._environ_template.copy()
+        path, _, query = uri.partition('?')
+        environ['REQUEST_METHOD'] = method
+        environ['REQUEST_URI'] = uri
+        environ['PATH_INFO'] = unquote_to_bytes(path).decode('iso-8859-1')
+        environ['QUERY_STRING'] = query
+        environ['SERVER_PROTOCOL'] = protocol
+        if isinstance(address, tuple):
+            environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = address[0], str(address[1])
+        for line in lines[1:-2]:
+            name, _, value = line.partition(':')
+            name = name.strip().upper().replace('-', '_')
+            value = value.strip()
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = 'HTTP_' + name
+            if name in environ:
+                environ[name] += ',' + value
+            else:
+                environ[name] = value
+        host, _, port = environ.get('HTTP_HOST', '').partition(':')
+        environ['SERVER_NAME'] = host or 'localhost'
+        environ['SERVER_PORT'] = port or '80'
+        environ['wsgi.url_scheme'] = 'http'
+        instance = cls._instance
+        connection = environ.get('HTTP_CONNECTION', '').lower()
+        if protocol == 'HTTP/1.1':
+            instance.keep_alive = 'close' not in connection
+        else:
+            instance.keep_alive = 'keep-alive' in connection
+        instance.request = (method, protocol)
+        if 'chunked' in environ.get('HTTP_TRANSFER_ENCODING', '').lower():
+            environ.pop('CONTENT_LENGTH', None)
+            environ['wsgi.input'] = ChunkedInputStream(environ, timeout)
+        else:
+            environ['wsgi.input'] = InputStream(environ, timeout)
+        if header_timeout is not None or body_timeout is not None:
+            # the body budget replaces the header one
+            stream.setDeadline(None if environ['wsgi.input']._loaded else body_timeout)
+        if environ.get('HTTP_EXPECT', '').lower() == '100-continue':
+            yield from stream.write(protocol.encode() + b' 100 Continue\r\n\r\n')
+        if not input_async:
+            yield from environ['squall.async_body_loader']()
+            del environ['squall.async_body_loader']
+        return environ
+
+    def _out_head(cls):
+        instance = cls._instance
+        if not instance.headers_sent:
+            method, protocol = instance.request
+            status = instance.out_headers[0][1]
+            headers = instance.out_headers[1:]
+            names = set(name.lower() for name, _ in headers)
+            code = int(status[:3])
+            if stream.draining:
+                instance.keep_alive = False
+            if 'connection' in names:
+                instance.keep_alive = instance.keep_alive and all(value.lower() != 'close'
+                                                                  for name, value in headers
+                                                                  if name.lower() == 'connection')
+            if (code >= 200 and code not in (204, 304) and method != 'HEAD'
+                    and 'content-length' not in names):
+                if protocol == 'HTTP/1.1':
+                    instance.chunked = True
+                    headers.append(('Transfer-Encoding', 'chunked'))
+                else:
+                    instance.keep_alive = False
+            if 'connection' not in names:
+                if not instance.keep_alive:
+                    headers.append(('Connection', 'close'))
+                elif protocol != 'HTTP/1.1':
+                    headers.append(('Connection', 'keep-alive'))
+            head = ''.join('{}: {}\r\n'.format(name, value) for name, value in headers)
+            head = 'HTTP/1.1 {}\r\n{}\r\n'.format(status, head)
+            # headers are queued to go out together with the first body chunk
+            yield from stream.write(head.encode('iso-8859-1'), flush=False)
+            instance.headers_sent = True
+
+    def _write(cls, data=b'', flush=False):
+        instance = cls._instance
+        flush = flush if instance.buffer_size > 0 else True
+        if len(data):
+            if instance.request[0] == 'HEAD':
+                data = b''
+            elif instance.chunked:
+                yield from stream.write(b'%X\r\n' % len(data), flush=False)
+                yield from stream.write(data, flush=False)
+                data = b'\r\n'
+        yield from stream.write(data, flush=flush)
+
+    def _write_file(cls, fd, offset, length):
+        instance = cls._instance
+        if instance.request[0] == 'HEAD' or not length:
+            return
+        if instance.chunked:
+            yield from stream.write(b'%X\r\n' % length, flush=False)
+            yield from stream.sendfile(fd, offset, length)
+            yield from stream.write(b'\r\n', flush=False)
+        else:
+            yield from stream.sendfile(fd, offset, length)
+
+    def _out_finish(cls, pipelined):
+        if not cls._headers_sent:
+            yield from cls._out_head()
+        if cls._instance.chunked:
+            yield from stream.write(b'0\r\n\r\n', flush=False)
+        # responses to pipelined requests go out together, until the queue
+        # exceeds buffer size or the connection waits for input or the pool
+        yield from stream.write(b'', flush=not pipelined)
+
+    def _out_error(cls, status):
+        response = 'HTTP/1.1 {}\r\nConnection: close\r\nContent-Length: 0\r\n\r\n'.format(status)
+        yield from stream.write(response.encode('iso-8859-1'))
+
+
+class wsgi(metaclass=HTTPGateway):
+    """Makes HTTP/1.1 application coroutine from a function or method."""
+    def __init__(self, run=None, chunk_size=None, buffer_size=None, timeout=None, input_async=False,
+                 nodelay=None, threaded=False, keepalive_timeout=15.0, max_header_size=64*1024,
+                 header_timeout=None, body_timeout=None, idle_timeout=None):
+        self._run = run
+        self._obj = self._coro = None
+        self.nodelay = nodelay
+        self.timeout = timeout
+        self.header_timeout = header_timeout
+        self.body_timeout = body_timeout
+        self.idle_timeout = idle_timeout
+        self.threaded = threaded
+        self.input_async = input_async and not threaded
+        self.keepalive_timeout = keepalive_timeout
+        self.max_header_size = max_header_size
+        self.chunk_size = chunk_size or 4*1024
+        self.buffer_size = buffer_size if buffer_size is not None else 256*1024
+        super(wsgi, self).__init__()
+
+    def __get__(self, obj, cls):
+        self._obj = obj
+
+    def __call__(self, *args, **kwargs):
+        if self._run is not None:
+            application = functools.partial(self._run, self._obj) if self._obj else self._run
+            if self._coro is None:
+                # application coroutine wrapper, serves requests of a persistent connection
+                @functools.wraps(self._run)
+                def wrapper(address):
+                    handle = coroutine.current
+                    keep_alive = True
+                    requests = 0
+                    while keep_alive:
+                        idle = requests > 0 and not len(stream._in_buffer)
+                        if idle and stream.draining:
+                            break
+                        requests += 1
+                        wsgi._init_instance(handle, self.chunk_size, self.buffer_size)
+                        try:
+                            # an idle keep-alive connection is closed at once by drain
+                            stream.setIdle(idle)
+                            try:
+                                environ = yield from wsgi._read_environ(
+                                    address, self.input_async or self.threaded, self.timeout,
+                                    self.keepalive_timeout, self.max_header_size,
+                                    self.header_timeout, self.body_timeout)
+                            except TimeoutError:
+                                break
+                            except ValueError as exc:
+                                log.warning("Bad request from: {}; {}".format(address, exc))
+                                yield from wsgi._out_error('400 Bad Request')
+                                break
+                            if environ is None:
+                                break
+                            stream.setIdle(False)
+                            if self.threaded:
+                                # queued responses to pipelined requests do not wait for the pool
+                                yield from stream.flush()
+                                yield from wsgi._run_threaded(application, environ)
+                            else:
+                                yield from wsgi._out_response(application(environ, wsgi._start_response))
+                            input_stream = environ['wsgi.input']
+                            input_stream.close()
+                            if not wsgi._headers_sent:
+                                # the head may switch the connection to close
+                                yield from wsgi._out_head()
+                            keep_alive = wsgi._keep_alive and input_stream._loaded
+                            yield from wsgi._out_finish(keep_alive and len(stream._in_buffer) > 0)
+                        finally:
+                            wsgi._release_instance(handle)
+                self._coro = stream(wrapper, self.chunk_size, self.buffer_size, self.nodelay, self.idle_timeout)
+            return self._coro(*args, **kwargs)
+        else:
+            self._run = args[0]
+            return self
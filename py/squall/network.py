@@ -1,173 +1,509 @@
 """`squall.network`"""
+import os
+import sys
+import json
 import errno
 import socket
-from time import time as now
+import functools
+import subprocess
+from itertools import islice
+from collections import deque
+from time import time as now, monotonic
 from squall.utilites import log, timeout_gen
+from squall.dispatcher import dispatcher, HIGH
+from squall.resolver import resolver
 from squall.coroutine import coroutine, READ, WRITE, TIMEOUT
 
 
+class Buffer(object):
+    """Stream buffer filled with `recv_into` and drained through memoryview.
+
+    The storage is held only while there are buffered bytes, so an idle
+    stream costs nothing. The first chunk is received into a scratch view
+    shared by all streams and copied out, later ones straight into the
+    storage, which grows up to size and is released once drained.
+    """
+    __slots__ = ('_size', '_data', '_view', '_start', '_end')
+    _empty = memoryview(bytearray())
+    _scratch = memoryview(bytearray(64*1024))
+
+    def __init__(self, size):
+        self._size = size
+        self._release()
+
+    def __len__(self):
+        return self._end - self._start
+
+    @property
+    def size(self):
+        """Buffer capacity."""
+        return self._size
+
+    def _release(self):
+        self._data = self._empty.obj
+        self._view = self._empty
+        self._start = self._end = 0
+
+    def find(self, sub):
+        """Returns offset of sub in buffered data or -1."""
+        pos = self._data.find(sub, self._start, self._end)
+        return pos - self._start if pos >= 0 else pos
+
+    def tail(self, number):
+        """Returns writable view of up to number bytes after buffered data.
+
+        The view is valid only until `commit`, which must follow it before
+        other streams run.
+        """
+        number = number if number < self._size else self._size
+        if not len(self._data):
+            if len(self._scratch) < number:
+                Buffer._scratch = memoryview(bytearray(number))
+            return self._scratch[:number]
+        length = self._end - self._start
+        if self._end + number > len(self._data):
+            if length + number > len(self._data) and len(self._data) < self._size:
+                # grows at least twice to keep the number of copies low
+                size = length + number if length + number > 2 * len(self._data) else 2 * len(self._data)
+                data = bytearray(size if size < self._size else self._size)
+                data[:length] = self._view[self._start:self._end]
+                self._data, self._view = data, memoryview(data)
+                self._start, self._end = 0, length
+            elif self._start > 0:
+                self._data[:length] = self._data[self._start:self._end]
+                self._start, self._end = 0, length
+        end = self._end + number
+        end = end if end < len(self._data) else len(self._data)
+        return self._view[self._end:end]
+
+    def commit(self, number):
+        """Appends number of bytes written into the tail view."""
+        if not len(self._data):
+            if number:
+                self._data = bytearray(self._scratch[:number])
+                self._view = memoryview(self._data)
+                self._start, self._end = 0, number
+            return
+        self._end += number
+
+    def view(self, number=None):
+        """Returns readonly view of up to number buffered bytes without draining them."""
+        number = len(self) if number is None or number > len(self) else number
+        return self._view[self._start:self._start+number].toreadonly()
+
+    def skip(self, number):
+        """Drains number of bytes without copying them."""
+        self._consume(number if number < len(self) else len(self))
+
+    def _consume(self, number):
+        self._start += number
+        if self._start == self._end:
+            self._release()
+
+    def read(self, number=None):
+        """Drains up to number of bytes."""
+        number = len(self) if number is None or number > len(self) else number
+        data = bytes(self._view[self._start:self._start+number])
+        self._consume(number)
+        return data
+
+    def read_into(self, view):
+        """Drains bytes into given memoryview; returns their number."""
+        number = len(self) if len(view) > len(self) else len(view)
+        view[:number] = self._view[self._start:self._start+number]
+        self._consume(number)
+        return number
+
+
+class StreamState(object):
+    """State of a stream, held by the context of its coroutine."""
+    __slots__ = ('socket', 'in_buffer', 'chunk_size', 'buffer_size', 'eof', 'out_queue', 'out_queued',
+                 'idle_timeout', 'active', 'deadline')
+
+    def __init__(self, client_socket, chunk_size, buffer_size):
+        self.socket = client_socket
+        self.in_buffer = Buffer(buffer_size)
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+        self.eof = False
+        self.out_queue = deque()
+        self.out_queued = 0
+        # limits enforced by the reaper, active is updated only if idle_timeout is set
+        self.idle_timeout = None
+        self.active = None
+        self.deadline = None
+
+
 class StreamAPI(type):
     """Stream API hub"""
     def __init__(cls, *args):
         cls._ci = dict()
+        cls._idle = set()
+        cls._draining = False
+        cls._limited = set()
+        cls._reaper = None
+        cls.reap_interval = 1.0
         super(StreamAPI, cls).__init__(*args)
 
     @property
-    def _socket(cls):
-        handle = coroutine.current
-        return cls._ci[handle][0] if handle is not None else None
+    def draining(cls):
+        """True while the process is draining connections before exit."""
+        return cls._draining
 
     @property
-    def _in_buffer(cls):
-        handle = coroutine.current
-        return cls._ci[handle][1] if handle is not None else None
-
-    @_in_buffer.setter
-    def _in_buffer(cls, value):
-        handle = coroutine.current
-        if handle is not None:
-            cls._ci[handle][1] = value
-        else:
-            raise AttributeError
+    def _instance(cls):
+        context = coroutine.context
+        return context.stream if context is not None else None
 
     @property
-    def _out_buffer(cls):
-        handle = coroutine.current
-        return cls._ci[handle][2] if handle is not None else None
-
-    @_out_buffer.setter
-    def _out_buffer(cls, value):
-        handle = coroutine.current
-        if handle is not None:
-            cls._ci[handle][2] = value
-        else:
-            raise AttributeError
+    def _socket(cls):
+        instance = cls._instance
+        return instance.socket if instance is not None else None
+
+    @property
+    def _in_buffer(cls):
+        instance = cls._instance
+        return instance.in_buffer if instance is not None else None
 
     @property
     def chunk_size(cls):
         """Chunk size of current stream."""
-        handle = coroutine.current
-        return cls._ci[handle][3] if handle is not None else None
+        instance = cls._instance
+        return instance.chunk_size if instance is not None else None
 
     @property
     def buffer_size(cls):
         """Buffer size of current stream."""
-        handle = coroutine.current
-        return cls._ci[handle][4] if handle is not None else None
+        instance = cls._instance
+        return instance.buffer_size if instance is not None else None
 
     @property
     def EOF(cls):
         """Returnf True if current stream EOF."""
-        handle = coroutine.current
-        return cls._ci[handle][5] if handle is not None else None
-
-    def _set_eof(cls, value):
-        handle = coroutine.current
-        if handle is not None:
-            cls._ci[handle][5] = value
-
-    def _fill_in_buff(cls, socket, timeout, chunk_size, buffer_size):
-        revents = yield from coroutine.wait(socket.fileno(), READ, next(timeout))
-        if revents & READ:
-            block_size = buffer_size - len(cls._in_buffer)
-            block_size = block_size if block_size < chunk_size else chunk_size
-            received = socket.recv(block_size)
-            if received:
-                cls._in_buffer += received
+        instance = cls._instance
+        return instance.eof if instance is not None else None
+
+    def _recv_into(cls, instance, view, timeout):
+        socket = instance.socket
+        while True:
+            # the socket is tracked edge-triggered, so try to receive
+            # first and wait for readiness only when it would block
+            try:
+                received = socket.recv_into(view)
+            except BlockingIOError:
+                if len(instance.out_queue):
+                    # queued bytes must not wait for the input, the peer may wait for them
+                    yield from cls._flush(instance, next(timeout))
+                    continue
+                revents = yield from coroutine.wait(socket.fileno(), READ, next(timeout))
+                if revents & TIMEOUT:
+                    raise OSError(errno.ETIMEDOUT, "Connection timed out.")
+                continue
+            if not received:
+                instance.eof = True
             else:
-                cls._set_eof(True)
-        elif revents & TIMEOUT:
-            raise OSError(errno.ETIMEDOUT, "Connection timed out.")
+                if instance.idle_timeout:
+                    instance.active = monotonic()
+                if dispatcher._stats is not None:
+                    dispatcher._stats.bytes_read += received
+            return received
+
+    def _fill_in_buff(cls, instance, timeout):
+        buffer = instance.in_buffer
+        received = yield from cls._recv_into(instance, buffer.tail(instance.chunk_size), timeout)
+        buffer.commit(received)
 
     def read(cls, number=None, timeout=None):
         """Read a number of bytes from current stream."""
-        assert coroutine.current in cls._ci
-        if cls.EOF:
+        instance = cls._instance
+        assert instance is not None, "Can called only from stream coroutine."
+        return (yield from cls._read(instance, number, timeout))
+
+    def _read(cls, instance, number=None, timeout=None):
+        if instance.eof:
             raise OSError(errno.ECONNRESET, "Connection was reset.")
-        data = b''
-        buffer_size = cls.buffer_size
+        buffer = instance.in_buffer
+        buffer_size = instance.buffer_size
         timeout = timeout_gen(timeout)
         number = number or buffer_size
         number = number if number < buffer_size else buffer_size
-        while not cls.EOF:
-            if number <= len(cls._in_buffer):
-                data = cls._in_buffer[:number]
-                cls._in_buffer = cls._in_buffer[number:]
-                break
-            yield from cls._fill_in_buff(cls._socket, timeout, cls.chunk_size, buffer_size)
-        else:
-            data = cls._in_buffer
-            cls._in_buffer = b''
-        return data
+        while not instance.eof:
+            if number <= len(buffer):
+                return buffer.read(number)
+            yield from cls._fill_in_buff(instance, timeout)
+        return buffer.read()
+
+    def read_into(cls, buffer, timeout=None):
+        """Read bytes from current stream into given writable buffer until it is full.
+
+        Returns number of read bytes, it is less than buffer length only at EOF.
+        """
+        instance = cls._instance
+        assert instance is not None, "Can called only from stream coroutine."
+        return (yield from cls._read_into(instance, buffer, timeout))
+
+    def _read_into(cls, instance, buffer, timeout=None):
+        if instance.eof:
+            raise OSError(errno.ECONNRESET, "Connection was reset.")
+        view = memoryview(buffer).cast('B')
+        timeout = timeout_gen(timeout)
+        number = instance.in_buffer.read_into(view)
+        while number < len(view) and not instance.eof:
+            number += yield from cls._recv_into(instance, view[number:], timeout)
+        return number
 
     def readUntil(cls, delimiter, max_number=None, timeout=None):
         """Read bytes from current stream until we have found the delimiter."""
-        assert coroutine.current in cls._ci
-        if cls.EOF:
+        instance = cls._instance
+        assert instance is not None, "Can called only from stream coroutine."
+        return (yield from cls._readUntil(instance, delimiter, max_number, timeout))
+
+    def _readUntil(cls, instance, delimiter, max_number=None, timeout=None):
+        if instance.eof:
             raise OSError(errno.ECONNRESET, "Connection was reset.")
-        data = b''
-        buffer_size = cls.buffer_size
+        buffer = instance.in_buffer
+        buffer_size = instance.buffer_size
         timeout = timeout_gen(timeout)
         max_number = max_number or buffer_size
         max_number = max_number if max_number < buffer_size else buffer_size
-        while not cls.EOF:
-            pos = cls._in_buffer.find(delimiter)
+        while not instance.eof:
+            pos = buffer.find(delimiter)
             if pos >= 0:
-                pos += len(delimiter)
-                data = cls._in_buffer[:pos]
-                cls._in_buffer = cls._in_buffer[pos:]
-                break
-            if max_number <= len(cls._in_buffer):
-                data = cls._in_buffer[:max_number]
-                cls._in_buffer = cls._in_buffer[max_number:]
-                break
-            yield from cls._fill_in_buff(cls._socket, timeout, cls.chunk_size, buffer_size)
-        else:
-            data = cls._in_buffer
-            cls._in_buffer = b''
-        return data
+                return buffer.read(pos + len(delimiter))
+            if max_number <= len(buffer):
+                return buffer.read(max_number)
+            yield from cls._fill_in_buff(instance, timeout)
+        return buffer.read()
 
     def readLine(cls, max_number=None, timeout=None):
         """Read line bytes from current stream terminated with LF."""
         return (yield from cls.readUntil(b'\n', max_number, timeout))
 
-    def write(cls, data, timeout=None):
-        """Write bytes to current stream."""
-        assert coroutine.current in cls._ci
-        chunk_size = cls.chunk_size
-        buffer_size = cls.buffer_size
+    def write(cls, data, timeout=None, flush=True):
+        """Write bytes to current stream.
+
+        If flush is False the data is queued until the queue exceeds buffer size
+        or the next flushing write, so that all queued buffers go out together
+        in a single `sendmsg` call.
+        """
+        instance = cls._instance
+        assert instance is not None, "Can called only from stream coroutine."
+        return (yield from cls._write(instance, data, timeout, flush))
+
+    def _write(cls, instance, data, timeout=None, flush=True):
+        if len(data):
+            if not flush and not isinstance(data, bytes):
+                data = bytes(data)
+            instance.out_queue.append(data)
+            instance.out_queued += len(data)
+        if flush or instance.out_queued >= instance.buffer_size:
+            yield from cls._flush(instance, timeout)
+        return len(data)
+
+    def flush(cls, timeout=None):
+        """Send all queued bytes of current stream."""
+        instance = cls._instance
+        assert instance is not None, "Can called only from stream coroutine."
+        return (yield from cls._flush(instance, timeout))
+
+    def _flush(cls, instance, timeout=None):
+        socket = instance.socket
+        queue = instance.out_queue
         timeout = timeout_gen(timeout)
-        can_sent = buffer_size - len(cls._out_buffer)
-        can_sent = can_sent if len(data) > can_sent else len(data)
-        cls._out_buffer += data[:can_sent]
-        while len(cls._out_buffer):
-            revents = yield from coroutine.wait(cls._socket.fileno(), WRITE, next(timeout))
-            if revents & WRITE:
-                block_size = chunk_size if chunk_size < len(cls._out_buffer) else len(cls._out_buffer)
-                sent = cls._socket.send(cls._out_buffer[:block_size])
-                cls._out_buffer = cls._out_buffer[sent:]
-            elif revents & TIMEOUT:
-                raise OSError(errno.ETIMEDOUT, "Connection timed out.")
-        return can_sent
+        while len(queue):
+            # try to send first and wait for readiness only when it would block
+            try:
+                sent = socket.sendmsg(islice(queue, 64))
+            except BlockingIOError:
+                revents = yield from coroutine.wait(socket.fileno(), WRITE, next(timeout))
+                if revents & TIMEOUT:
+                    raise OSError(errno.ETIMEDOUT, "Connection timed out.")
+                continue
+            instance.out_queued -= sent
+            if instance.idle_timeout:
+                instance.active = monotonic()
+            if dispatcher._stats is not None:
+                dispatcher._stats.bytes_written += sent
+            while sent:
+                if len(queue[0]) <= sent:
+                    sent -= len(queue.popleft())
+                else:
+                    queue[0] = memoryview(queue[0])[sent:]
+                    sent = 0
 
-    def _init_instance(cls, handle, client_socket, chunk_size, buffer_size):
+    def sendfile(cls, file, offset=0, count=None, timeout=None):
+        """Send count bytes of file from offset to current stream with `os.sendfile`.
+
+        Queued bytes are flushed before. Returns number of sent bytes, it is less
+        than count only if the file is shorter.
+        """
+        instance = cls._instance
+        assert instance is not None, "Can called only from stream coroutine."
+        return (yield from cls._sendfile(instance, file, offset, count, timeout))
+
+    def _sendfile(cls, instance, file, offset=0, count=None, timeout=None):
+        yield from cls._flush(instance, timeout)
+        fd = file if isinstance(file, int) else file.fileno()
+        count = os.fstat(fd).st_size - offset if count is None else count
+        socket = instance.socket
+        timeout = timeout_gen(timeout)
+        sent_total = 0
+        while sent_total < count:
+            try:
+                sent = os.sendfile(socket.fileno(), fd, offset + sent_total, count - sent_total)
+            except BlockingIOError:
+                revents = yield from coroutine.wait(socket.fileno(), WRITE, next(timeout))
+                if revents & TIMEOUT:
+                    raise OSError(errno.ETIMEDOUT, "Connection timed out.")
+                continue
+            if not sent:
+                break
+            sent_total += sent
+            if instance.idle_timeout:
+                instance.active = monotonic()
+            if dispatcher._stats is not None:
+                dispatcher._stats.bytes_written += sent
+        return sent_total
+
+    def _setsockopt(cls, level, option, value, client_socket=None):
+        try:
+            (client_socket or cls._socket).setsockopt(level, option, 1 if value else 0)
+            return True
+        except OSError:
+            return False
+
+    def setCork(cls, value):
+        """Sets TCP_CORK of current stream, returns False if it is not supported."""
+        return cls._setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, value)
+
+    def setIdleTimeout(cls, timeout):
+        """Sets idle timeout of current stream, it is closed by the reaper after timeout without I/O."""
+        instance = cls._instance
+        assert instance is not None, "Can called only from stream coroutine."
+        instance.idle_timeout = timeout or None
+        instance.active = monotonic()
+        cls._limit(coroutine.current, instance)
+
+    def setDeadline(cls, timeout):
+        """Sets deadline of current stream in timeout seconds from now, None clears it.
+
+        The reaper interrupts a stream waiting for I/O after its deadline
+        with `TimeoutError`, however many times it has received data.
+        """
+        instance = cls._instance
+        assert instance is not None, "Can called only from stream coroutine."
+        instance.deadline = monotonic() + timeout if timeout is not None else None
+        cls._limit(coroutine.current, instance)
+
+    def _limit(cls, handle, instance):
+        if instance.deadline is None and not instance.idle_timeout:
+            cls._limited.discard(handle)
+            return
+        cls._limited.add(handle)
+        if cls._reaper is None:
+            cls._reaper = dispatcher.watch(cls._reap, timeout=cls.reap_interval)
+
+    def _reap(cls, revents):
+        # one periodic sweep enforces the limits of all streams, instead of
+        # a timer per waiting; a stream is interrupted only while it waits for I/O
+        cls._reaper = None
+        current = monotonic()
+        for handle in list(cls._limited):
+            instance = cls._ci.get(handle)
+            if instance is None or instance.socket is None:
+                cls._limited.discard(handle)
+                continue
+            if instance.deadline is not None and instance.deadline <= current:
+                reason = "deadline has expired"
+            elif instance.idle_timeout and current - instance.active >= instance.idle_timeout:
+                reason = "idle timeout has expired"
+            else:
+                continue
+            if dispatcher.unwatch(instance.socket.fileno()):
+                log.info("Reaped connection with handle: {:X}; {}.".format(handle, reason))
+                instance.deadline = None
+                instance.idle_timeout = None
+                cls._limited.discard(handle)
+                coroutine.throw(handle, OSError(errno.ETIMEDOUT, "Connection {}.".format(reason)))
+        if cls._limited:
+            cls._reaper = dispatcher.watch(cls._reap, timeout=cls.reap_interval)
+
+    def setIdle(cls, value):
+        """Marks current connection as idle, it is closed at once by `drain`."""
+        if value:
+            cls._idle.add(coroutine.current)
+        else:
+            cls._idle.discard(coroutine.current)
+
+    def setNoDelay(cls, value):
+        """Sets TCP_NODELAY of current stream, returns False if it is not supported."""
+        return cls._setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, value)
+
+    def connect(cls, address, timeout=None, chunk_size=None, buffer_size=None, nodelay=None):
+        """Connects to address without blocking; returns `Connection` with the stream API."""
+        assert coroutine.current is not None, "Can called only from coroutine."
+        host, port = address
+        addrinfo = yield from resolver.getaddrinfo(host, port, socket.AF_UNSPEC, socket.SOCK_STREAM)
+        timeout = timeout_gen(timeout)
+        error = OSError(errno.EHOSTUNREACH, "Cannot connect to: {}.".format(address))
+        for family, socktype, proto, _, addr in addrinfo:
+            client_socket = socket.socket(family, socktype, proto)
+            client_socket.setblocking(False)
+            dispatcher.track(client_socket.fileno())
+            try:
+                code = client_socket.connect_ex(addr)
+                if code == errno.EINPROGRESS:
+                    revents = yield from coroutine.wait(client_socket.fileno(), WRITE, next(timeout))
+                    if revents & TIMEOUT:
+                        raise OSError(errno.ETIMEDOUT, "Connection timed out.")
+                    code = client_socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if code:
+                    raise OSError(code, os.strerror(code))
+            except OSError as exc:
+                dispatcher.release(client_socket.fileno())
+                client_socket.close()
+                error = exc
+                if exc.errno == errno.ETIMEDOUT:
+                    break
+                continue
+            connection = Connection(cls._make_state(client_socket, chunk_size, buffer_size), addr)
+            if nodelay is not None:
+                connection.setNoDelay(nodelay)
+            log.debug("Connected to: {}.".format(addr))
+            return connection
+        raise error
+
+    def _make_state(cls, client_socket, chunk_size, buffer_size):
         chunk_size = chunk_size or 4*1024
         chunk_size = chunk_size if chunk_size > 1024 else 1024
         chunk_size = chunk_size if chunk_size < 64*1024 else 64*1024
         buffer_size = buffer_size or 256*1024
         buffer_size = buffer_size if buffer_size > 1024*8 else 1024*8
         buffer_size = buffer_size if buffer_size < chunk_size*8 else chunk_size*8
-        cls._ci[handle] = [client_socket, b'', b'', chunk_size, buffer_size, False]
+        return StreamState(client_socket, chunk_size, buffer_size)
+
+    def _init_instance(cls, handle, client_socket, chunk_size, buffer_size):
+        instance = cls._make_state(client_socket, chunk_size, buffer_size)
+        coroutine._context(handle).stream = cls._ci[handle] = instance
 
     def _release_instance(cls, handle):
         del cls._ci[handle]
+        cls._idle.discard(handle)
+        cls._limited.discard(handle)
+        if not cls._limited and cls._reaper is not None:
+            dispatcher.cancel(cls._reaper)
+            cls._reaper = None
+        if handle in coroutine._all:
+            coroutine._all[handle].stream = None
 
 
 class stream(metaclass=StreamAPI):
     """Makes stream coroutine from a function or method."""
-    def __init__(self, run=None, chunk_size=None, buffer_size=None):
+    def __init__(self, run=None, chunk_size=None, buffer_size=None, nodelay=None, idle_timeout=None):
         self._run = run
         self._obj = self._coro = None
+        self.nodelay = nodelay
+        self.idle_timeout = idle_timeout
         self.chunk_size = chunk_size
         self.buffer_size = buffer_size
         super(stream, self).__init__()
@@ -180,15 +516,22 @@ class stream(metaclass=StreamAPI):
             run = functools.partial(self._run, self._obj) if self._obj else self._run
             if self._coro is None:
                 # stream coroutine wrapper
+                @functools.wraps(self._run)
                 def wrapper(client_socket, address):
                     handle = coroutine.current
                     client_socket.setblocking(False)
+                    dispatcher.track(client_socket.fileno())
                     stream._init_instance(handle, client_socket, self.chunk_size, self.buffer_size)
+                    if self.nodelay is not None:
+                        stream.setNoDelay(self.nodelay)
+                    if self.idle_timeout:
+                        stream.setIdleTimeout(self.idle_timeout)
                     log.debug("Accepted connection from: {}.".format(address))
                     try:
                         yield from run(address)
                     finally:
                         stream._release_instance(handle)
+                        dispatcher.release(client_socket.fileno())
                         try:
                             client_socket.shutdown(socket.SHUT_RDWR)
                         except OSError:
@@ -202,22 +545,130 @@ class stream(metaclass=StreamAPI):
             return self
 
 
+class Connection(object):
+    """Outbound connection made by `stream.connect`, has the read and write API of stream."""
+    def __init__(self, instance, address):
+        self._instance = instance
+        self.address = address
+
+    @property
+    def socket(self):
+        """Connection socket, None if closed."""
+        return self._instance.socket
+
+    @property
+    def closed(self):
+        """True if connection is closed."""
+        return self._instance.socket is None
+
+    @property
+    def EOF(self):
+        """True if the peer has closed connection."""
+        return self._instance.eof
+
+    def read(self, number=None, timeout=None):
+        """Read a number of bytes from connection."""
+        return (yield from stream._read(self._instance, number, timeout))
+
+    def read_into(self, buffer, timeout=None):
+        """Read bytes from connection into given writable buffer until it is full."""
+        return (yield from stream._read_into(self._instance, buffer, timeout))
+
+    def readUntil(self, delimiter, max_number=None, timeout=None):
+        """Read bytes from connection until we have found the delimiter."""
+        return (yield from stream._readUntil(self._instance, delimiter, max_number, timeout))
+
+    def readLine(self, max_number=None, timeout=None):
+        """Read line bytes from connection terminated with LF."""
+        return (yield from stream._readUntil(self._instance, b'\n', max_number, timeout))
+
+    def write(self, data, timeout=None, flush=True):
+        """Write bytes to connection."""
+        return (yield from stream._write(self._instance, data, timeout, flush))
+
+    def flush(self, timeout=None):
+        """Send all queued bytes of connection."""
+        return (yield from stream._flush(self._instance, timeout))
+
+    def setNoDelay(self, value):
+        """Sets TCP_NODELAY of connection, returns False if it is not supported."""
+        return stream._setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, value, self.socket)
+
+    def close(self):
+        """Closes connection."""
+        client_socket = self._instance.socket
+        if client_socket is not None:
+            self._instance.socket = None
+            dispatcher.release(client_socket.fileno())
+            client_socket.close()
+            log.debug("Closed connection to: {}.".format(self.address))
+
+
 @coroutine
-def acceptor(coroinst, server_socket):
+def acceptor(coroinst, server_socket, max_connections=None, budget=64, cleanup=None):
+    """Accepts connections in batches up to budget and starts coroinst for each.
+
+    When max_connections are served, the listener is not watched and
+    the backlog is left to the kernel until any of them has finished.
+    The cleanup is called after the listener has been closed.
+    """
+    handle = coroutine.current
+    fd = server_socket.fileno()
+    connections = 0
+    paused = False
+
+    def resume(revents):
+        nonlocal paused
+        # the acceptor might have been finished meanwhile
+        if paused:
+            paused = False
+            coroutine.switch(handle, revents)
+
+    def finished(result, exception):
+        nonlocal connections
+        connections -= 1
+        if paused:
+            dispatcher.call(resume, HIGH)
+
     log.info("Established listener on: {}.".format(server_socket.getsockname()))
     try:
         while True:
-            revents = yield from coroutine.wait(server_socket.fileno(), READ)
-            if revents & READ:
-                client_socket, address = server_socket.accept()
-                coroinst(client_socket, address)
+            if max_connections and connections >= max_connections:
+                paused = True
+                yield
+                continue
+            for _ in range(budget):
+                try:
+                    client_socket, address = server_socket.accept()
+                except BlockingIOError:
+                    # the backlog is empty or accepted by another worker process
+                    yield from coroutine.wait(fd, READ)
+                    break
+                except OSError as exc:
+                    if exc.errno == errno.ECONNABORTED:
+                        continue
+                    if exc.errno not in (errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM):
+                        raise
+                    log.warning("Cannot accept connection: {}.".format(exc))
+                    yield from coroutine.sleep(0.1)
+                    break
+                connections += 1
+                coroutine.notify(coroinst(client_socket, address), finished)
+                if max_connections and connections >= max_connections:
+                    break
+            else:
+                # the budget is exhausted, lets other coroutines run before the next batch
+                yield from coroutine.sleep(priority=HIGH)
     finally:
+        paused = False
         log.debug("Finished listener on: {}.".format(server_socket.getsockname()))
+        dispatcher.release(fd)
         server_socket.close()
+        if cleanup is not None:
+            cleanup()
 
 
-def streamServer(coroinst, address, backlog):
-    """Starts TCP server."""
+def _listen_tcp(address, backlog):
     result = list()
     host, port = address
     addrinfo = socket.getaddrinfo(host, port, socket.AF_UNSPEC,
@@ -228,7 +679,6 @@ def streamServer(coroinst, address, backlog):
             server_socket = socket.socket(family, socktype, proto)
         except OSError as exc:
             log.warning("Cannot create server socket: {}.".format((family, socktype, proto)))
-            server_socket = None
             continue
         # bind and setup socket
         try:
@@ -238,14 +688,207 @@ def streamServer(coroinst, address, backlog):
         except OSError as exc:
             log.warning("Cannot setup server socket: {}.".format((family, socktype, proto, addr)))
             server_socket.close()
-            server_socket = None
             continue
+        result.append((server_socket, None))
+    return result
+
+
+def _listen_unix(path, backlog, mode):
+    if not path.startswith('@') and os.path.exists(path):
+        # a socket file left by a dead process is removed, a live one is kept
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+        except OSError:
+            pass
+        else:
+            log.warning("Unix socket is in use: {}.".format(path))
+            return []
+        finally:
+            probe.close()
+    server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        # leading @ means the abstract namespace of linux
+        server_socket.bind('\0' + path[1:] if path.startswith('@') else path)
+        if mode is not None and not path.startswith('@'):
+            os.chmod(path, mode)
+        server_socket.listen(backlog)
+    except OSError as exc:
+        log.warning("Cannot setup unix socket: {}; {}.".format(path, exc))
+        server_socket.close()
+        return []
+    if path.startswith('@'):
+        return [(server_socket, None)]
+    return [(server_socket, _unix_cleanup(path))]
+
+
+def _unix_cleanup(path):
+    # only the process that owns the socket removes its file
+    pid, inode = os.getpid(), os.stat(path).st_ino
+
+    def cleanup():
+        try:
+            if os.getpid() == pid and os.stat(path).st_ino == inode:
+                os.unlink(path)
+        except OSError:
+            pass
+    return cleanup
+
+
+def _listen_fds(address):
+    # adopts already listening sockets, passed as "fd:N" or by systemd socket activation
+    if isinstance(address, int):
+        fds = [address]
+    elif address.startswith('fd:'):
+        fds = [int(address[3:])]
+    else:
+        if os.environ.get('LISTEN_PID') != str(os.getpid()):
+            log.warning("No sockets passed by systemd to this process.")
+            return []
+        fds = list(range(3, 3 + int(os.environ.get('LISTEN_FDS', '0'))))
+        name = address[len('systemd:'):] if address.startswith('systemd:') else None
+        if name is not None:
+            names = os.environ.get('LISTEN_FDNAMES', '').split(':')
+            fds = [fd for fd, fd_name in zip(fds, names) if fd_name == name]
+    result = list()
+    for fd in fds:
+        server_socket = socket.socket(fileno=fd)
+        if not server_socket.getsockopt(socket.SOL_SOCKET, socket.SO_ACCEPTCONN):
+            log.warning("Passed fd {} is not a listening socket.".format(fd))
+            server_socket.detach()
+            continue
+        result.append((server_socket, None))
+    return result
+
+
+def _listener_key(address):
+    return '{}:{}'.format(*address[:2]) if isinstance(address, tuple) else str(address)
+
+
+def _take_inherited():
+    # listeners handed off by the predecessor process, by their keys;
+    # the variable is dropped so that it does not leak to other children
+    try:
+        return json.loads(os.environ.pop('SQUALL_LISTEN_FDS', '{}'))
+    except ValueError:
+        log.warning("Cannot parse SQUALL_LISTEN_FDS.")
+        return dict()
+
+
+# acceptor handle: [key, server socket, cleanup]
+_listeners = dict()
+_inherited = _take_inherited()
+
+
+def _unregister(handle, result, exception):
+    _, _, cleanup = _listeners.pop(handle)
+    if cleanup is not None:
+        cleanup()
+
+
+def streamServer(coroinst, address, backlog, max_connections=None, mode=None):
+    """Starts stream server, serves up to max_connections at once if set.
+
+    The address is (host, port) for TCP, "unix:/path" for unix socket
+    with the file mode, "fd:N" for an inherited listening socket or
+    "systemd[:name]" for sockets passed by systemd socket activation.
+    Listeners handed off by the predecessor process are adopted by
+    the same address instead of binding it.
+    """
+    key = _listener_key(address)
+    fds = _inherited.pop(key, None)
+    if fds is not None:
+        listeners = [listener for fd in fds for listener in _listen_fds(fd)]
+        if key.startswith('unix:') and not key.startswith('unix:@'):
+            listeners = [(server_socket, _unix_cleanup(key[5:])) for server_socket, _ in listeners]
+        log.info("Adopted listeners of: {}.".format(address))
+    elif isinstance(address, int) or isinstance(address, str) and address.startswith(('fd:', 'systemd')):
+        listeners = _listen_fds(address)
+    elif isinstance(address, str) and address.startswith('unix:'):
+        listeners = _listen_unix(address[5:], backlog, mode)
+    else:
+        listeners = _listen_tcp(address, backlog)
+    result = list()
+    for server_socket, cleanup in listeners:
+        server_socket.setblocking(False)
         # create coroutine-acceptor
         try:
-            handle = acceptor(coroinst, server_socket)
+            handle = acceptor(coroinst, server_socket, max_connections)
+            _listeners[handle] = [key, server_socket, cleanup]
+            coroutine.notify(handle, functools.partial(_unregister, handle))
             result.append(handle)
         except Exception as exc:
-            log.exception("Cannot create connection acceptor on: {}.", addr)
+            log.exception("Cannot create connection acceptor on: {}.", server_socket)
     if len(result) == 0:
         log.error("Cannot start server: {}.".format(address))
     return result
+
+
+def handoff(args=None):
+    """Starts the successor process which inherits all listeners; returns its pid.
+
+    The successor is started with args, the same command line by default,
+    and its `streamServer` adopts the listener of the same address.
+    """
+    fds = dict()
+    for key, server_socket, _ in _listeners.values():
+        fds.setdefault(key, list()).append(server_socket.fileno())
+    env = dict(os.environ, SQUALL_LISTEN_FDS=json.dumps(fds))
+    process = subprocess.Popen(args or [sys.executable] + sys.argv, env=env,
+                               pass_fds=[fd for value in fds.values() for fd in value])
+    # the successor owns unix socket files from now on
+    for entry in _listeners.values():
+        entry[2] = None
+    log.info("Handed off listeners to process: {}.".format(process.pid))
+    return process.pid
+
+
+def drain(deadline=30.0):
+    """Stops accepting and stops event dispatching when served connections have finished.
+
+    Idle connections are closed at once, the rest of them are dropped
+    by `squall.stop` when deadline has expired.
+    """
+    if stream._draining:
+        return
+    stream._draining = True
+    for handle in list(_listeners):
+        coroutine.throw(handle, GeneratorExit)
+    for handle in list(stream._idle):
+        coroutine.throw(handle, GeneratorExit)
+    remaining = set(stream._ci)
+    timer = None
+
+    def stop():
+        if timer is not None:
+            dispatcher.cancel(timer)
+        stream._draining = False
+        dispatcher.stop()
+
+    def finished(handle, result, exception):
+        remaining.discard(handle)
+        if not remaining:
+            log.info("Drained all connections.")
+            stop()
+
+    def expire(revents):
+        log.warning("Drain deadline has expired, dropped connections: {}.".format(len(remaining)))
+        stop()
+
+    if not remaining:
+        stop()
+        return
+    log.info("Draining connections: {}.".format(len(remaining)))
+    for handle in remaining:
+        coroutine.notify(handle, functools.partial(finished, handle))
+    if deadline:
+        timer = dispatcher.watch(expire, timeout=deadline)
+
+
+def reload(deadline=30.0, args=None):
+    """Hands listeners off to the successor process and drains this one; returns its pid."""
+    pid = handoff(args)
+    drain(deadline)
+    return pid
@@ -0,0 +1,148 @@
+"""`squall.pool`"""
+import errno
+import socket
+import functools
+from collections import deque
+from time import monotonic as now
+from squall.utilites import log
+from squall.dispatcher import dispatcher
+from squall.coroutine import coroutine
+from squall.network import stream
+
+
+class ConnectionPool(object):
+    """Pool of keep-alive outbound connections to the one destination.
+
+    Idle connections are reused most recent first, checked before reuse
+    and closed after idle_timeout. Up to max_size connections are open
+    at once, other acquirers wait for a released one.
+    """
+    def __init__(self, address, max_size=10, idle_timeout=30.0, connect_timeout=None,
+                 check=None, **stream_options):
+        self.address = address
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.check = check
+        self._options = stream_options
+        self._size = 0
+        self._idle = deque()
+        self._waiters = deque()
+        self._evictor = None
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def idle(self):
+        """Number of idle connections."""
+        return len(self._idle)
+
+    def _healthy(self, connection):
+        if connection.closed or connection.EOF or len(connection._instance.in_buffer):
+            return False
+        try:
+            connection.socket.recv(1, socket.MSG_PEEK)
+            # idle connection must have nothing to read, else it is closed or out of sync
+            return False
+        except BlockingIOError:
+            pass
+        except OSError:
+            return False
+        return self.check is None or self.check(connection)
+
+    def acquire(self, timeout=None):
+        """Returns idle or new connection, waits a released one if the pool is full."""
+        while True:
+            while self._idle:
+                connection, _ = self._idle.pop()
+                if self._healthy(connection):
+                    return connection
+                self._discard(connection)
+            if self._size < self.max_size:
+                self._size += 1
+                try:
+                    return (yield from stream.connect(self.address, self.connect_timeout, **self._options))
+                except:
+                    self._size -= 1
+                    self._wakeup(False)
+                    raise
+            connection = yield from self._wait(timeout)
+            if connection:
+                return connection
+
+    def release(self, connection):
+        """Returns connection to the pool; closed or broken one is discarded."""
+        if connection.closed or connection.EOF or connection._instance.out_queued:
+            self._discard(connection)
+        elif not self._wakeup(connection):
+            self._idle.append((connection, now()))
+            if self._evictor is None and self.idle_timeout:
+                self._evictor = dispatcher.watch(self._evict, timeout=self.idle_timeout)
+
+    def close(self):
+        """Closes all idle connections."""
+        while self._idle:
+            self._discard(self._idle.pop()[0])
+        if self._evictor is not None:
+            dispatcher.cancel(self._evictor)
+            self._evictor = None
+
+    def _discard(self, connection):
+        connection.close()
+        self._size -= 1
+        self._wakeup(False)
+
+    def _evict(self, revents):
+        self._evictor = None
+        deadline = now() - self.idle_timeout
+        while self._idle and self._idle[0][1] <= deadline:
+            connection, _ = self._idle.popleft()
+            log.debug("Evicted idle connection to: {}.".format(connection.address))
+            self._discard(connection)
+        if self._idle:
+            timeout = self._idle[0][1] - deadline
+            self._evictor = dispatcher.watch(self._evict, timeout=timeout)
+
+    def _wait(self, timeout):
+        # parks current coroutine until _wakeup passes it a connection,
+        # or False when a slot is freed; None means timed out
+        waiter = [coroutine.current, None]
+
+        def expire(revents):
+            self._waiters.remove(waiter)
+            coroutine.switch(waiter[0], None)
+
+        if timeout:
+            waiter[1] = dispatcher.watch(expire, timeout=timeout)
+        self._waiters.append(waiter)
+        try:
+            connection = yield
+        except:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                if waiter[1] is not None:
+                    dispatcher.cancel(waiter[1])
+            waiter[0] = None
+            raise
+        if connection is None:
+            raise OSError(errno.ETIMEDOUT, "Connection pool timed out.")
+        return connection
+
+    def _wakeup(self, connection):
+        # hands connection, or False as freed slot, over to the first waiter
+        if not self._waiters:
+            return False
+        waiter = self._waiters.popleft()
+        if waiter[1] is not None:
+            dispatcher.cancel(waiter[1])
+        dispatcher.call(functools.partial(self._handover, waiter, connection))
+        return True
+
+    def _handover(self, waiter, connection, revents):
+        if waiter[0] is not None:
+            coroutine.switch(waiter[0], connection)
+        elif connection:
+            self.release(connection)
+        else:
+            self._wakeup(False)
@@ -0,0 +1,77 @@
+"""`squall.prefork`"""
+import os
+import signal
+from time import sleep, monotonic as now
+from squall.utilites import log
+from squall.dispatcher import dispatcher
+
+
+class Supervisor(object):
+    """Runs event dispatching in pre-forked worker processes.
+
+    Listeners created before the fork are inherited by all workers,
+    so the kernel balances accepts between them. The supervisor
+    restarts workers which have died and terminates all of them
+    when it receives SIGINT or SIGTERM.
+    """
+    def __init__(self, workers, run, respawn_delay=1.0):
+        self._run = run
+        self._workers = workers
+        self._respawn_delay = respawn_delay
+        self._children = dict()
+        self._stopping = False
+
+    @property
+    def children(self):
+        """PIDs of running workers."""
+        return tuple(self._children.keys())
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGINT, signal.default_int_handler)
+                signal.signal(signal.SIGTERM, signal.default_int_handler)
+                dispatcher.reinit()
+                self._run()
+            except BaseException:
+                log.exception("Worker {} has failed:".format(os.getpid()))
+                code = 1
+            finally:
+                os._exit(code)
+        self._children[pid] = now()
+        log.info("Started worker: {}.".format(pid))
+
+    def _terminate(self, signum, frame):
+        self._stopping = True
+        for pid in self._children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def start(self):
+        """Starts workers and supervises them until they are finished."""
+        handlers = {signum: signal.signal(signum, self._terminate)
+                    for signum in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            for _ in range(self._workers):
+                self._spawn()
+            while len(self._children):
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
+                    break
+                started_at = self._children.pop(pid, None)
+                if started_at is None or self._stopping or status == 0:
+                    log.info("Finished worker: {}.".format(pid))
+                    continue
+                log.warning("Worker {} has died with status: {}.".format(pid, status))
+                if now() - started_at < self._respawn_delay:
+                    sleep(self._respawn_delay)
+                if not self._stopping:
+                    self._spawn()
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
@@ -0,0 +1,95 @@
+"""`squall.process`"""
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+# buffers of this size and larger pass through shared memory instead of the pipe
+SHARED_THRESHOLD = 64*1024
+
+# descriptor of a buffer in the shared memory segment
+Shared = namedtuple('Shared', ('name', 'size'))
+
+
+def executor(workers=None):
+    """Returns a new process pool executor for `run_in_process`."""
+    # workers share the resource tracker of this process, which owns all segments
+    resource_tracker.ensure_running()
+    # workers are forked from a clean server process, not from the running loop
+    # with its epoll fd, sockets and threads
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('forkserver'))
+
+
+def _large(value):
+    return isinstance(value, (bytes, bytearray, memoryview)) and memoryview(value).nbytes >= SHARED_THRESHOLD
+
+
+def _store(value):
+    view = memoryview(value).cast('B')
+    segment = SharedMemory(create=True, size=view.nbytes)
+    segment.buf[:view.nbytes] = view
+    return segment, Shared(segment.name, view.nbytes)
+
+
+def share(args):
+    """Stores large buffers of args in shared memory; returns (args, segments)."""
+    segments = list()
+    result = list()
+    for arg in args:
+        if _large(arg):
+            segment, arg = _store(arg)
+            segments.append(segment)
+        result.append(arg)
+    return tuple(result), segments
+
+
+def release(segments):
+    """Frees the segments of `share`."""
+    for segment in segments:
+        segment.close()
+        segment.unlink()
+
+
+def receive(result):
+    """Returns the result of `call`, reading it from shared memory if needed."""
+    if not isinstance(result, Shared):
+        return result
+    segment = SharedMemory(result.name)
+    try:
+        return bytes(segment.buf[:result.size])
+    finally:
+        segment.close()
+        segment.unlink()
+
+
+def discard(future):
+    """Frees the shared result of an abandoned call when its future is done."""
+    if not future.cancelled() and future.exception() is None:
+        receive(future.result())
+
+
+def call(fn, args):
+    """Calls fn in the worker; shared args come as read-only memoryviews."""
+    attached = list()
+    try:
+        args = list(args)
+        for index, arg in enumerate(args):
+            if isinstance(arg, Shared):
+                segment = SharedMemory(arg.name)
+                args[index] = segment.buf[:arg.size].toreadonly()
+                attached.append((segment, args[index]))
+        result = fn(*args)
+    finally:
+        del args
+        for segment, view in attached:
+            try:
+                view.release()
+                segment.close()
+            except BufferError:
+                # fn has kept the buffer, the mapping is freed together with it
+                pass
+    if _large(result):
+        segment, result = _store(result)
+        segment.close()
+    return result
@@ -0,0 +1,148 @@
+"""`squall.profiler`"""
+import sys
+import threading
+import traceback
+from time import perf_counter, thread_time
+from squall.utilites import log
+from squall.coroutine import coroutine
+
+
+def _name(corogen):
+    return getattr(corogen, '__qualname__', None) or repr(corogen)
+
+
+def _yield_stack(corogen):
+    # the chain of yield points of a suspended coroutine
+    lines = list()
+    while corogen is not None and getattr(corogen, 'gi_frame', None) is not None:
+        frame = corogen.gi_frame
+        lines.append('  File "{}", line {}, in {}\n'.format(
+            frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name))
+        corogen = getattr(corogen, 'gi_yieldfrom', None)
+    return ''.join(lines)
+
+
+class Profiler(object):
+    """Per-coroutine CPU and wall time profiler.
+
+    It is called by the coroutine context at every switch only while it
+    is enabled. A step longer than threshold seconds is logged with the
+    stack sampled by the watchdog thread while the step was running, or
+    with the yield point of the coroutine if there is no sample.
+    """
+    def __init__(self, threshold=0.1, watchdog=True):
+        self.threshold = threshold
+        self.reset()
+        # entries: [context, wall started, cpu started, nested wall, nested cpu]
+        self._stack = list()
+        self._thread_id = threading.get_ident()
+        self._step = None
+        self._sampled = None
+        self._stopped = threading.Event()
+        if watchdog and threshold:
+            thread = threading.Thread(target=self._watchdog, name='squall-watchdog', daemon=True)
+            thread.start()
+
+    def reset(self):
+        """Resets all counters."""
+        # handle: [name, switches, cpu, wall, max step]
+        self.coroutines = dict()
+        # name: [coroutines, switches, cpu, wall, max step]
+        self.functions = dict()
+        self.slow_steps = 0
+
+    def stop(self):
+        """Stops the watchdog thread."""
+        self._stopped.set()
+
+    def enter(self, context):
+        started = perf_counter()
+        self._stack.append([context, started, thread_time(), 0.0, 0.0])
+        if len(self._stack) == 1:
+            self._step = started
+
+    def exit(self, context, terminated):
+        finished = perf_counter()
+        if not self._stack or self._stack[-1][0] is not context:
+            # the profiler has been enabled during this switch
+            return
+        _, started, cpu_started, nested_wall, nested_cpu = self._stack.pop()
+        wall = finished - started
+        cpu = thread_time() - cpu_started
+        if self._stack:
+            # time of a nested switch is accounted only to the nested coroutine
+            self._stack[-1][3] += wall
+            self._stack[-1][4] += cpu
+        else:
+            self._step = None
+        wall -= nested_wall
+        cpu -= nested_cpu
+        record = self.coroutines.get(context.handle)
+        if record is None:
+            record = self.coroutines[context.handle] = [_name(context.corogen), 0, 0.0, 0.0, 0.0]
+            function = self.functions.setdefault(record[0], [0, 0, 0.0, 0.0, 0.0])
+            function[0] += 1
+        else:
+            function = self.functions[record[0]]
+        for entry in (record, function):
+            entry[1] += 1
+            entry[2] += cpu
+            entry[3] += wall
+            if wall > entry[4]:
+                entry[4] = wall
+        if self.threshold and wall > self.threshold:
+            self.slow_steps += 1
+            sampled = self._sampled
+            if sampled is not None and sampled[0] == started:
+                stack = sampled[1]
+            else:
+                stack = _yield_stack(context.corogen)
+            log.warning("Coroutine {} with handle: {:X} has blocked the loop for {:.1f} ms:\n{}".format(
+                record[0], context.handle, wall * 1000, stack))
+        if terminated:
+            del self.coroutines[context.handle]
+
+    def _watchdog(self):
+        # samples the stack of the loop thread while a step is longer than threshold
+        while not self._stopped.wait(self.threshold / 4):
+            started = self._step
+            if started is None or perf_counter() - started < self.threshold:
+                continue
+            if self._sampled is not None and self._sampled[0] == started:
+                continue
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self._sampled = (started, ''.join(traceback.format_stack(frame)))
+
+    def report(self, limit=10):
+        """Returns the heaviest by CPU time running coroutines and functions as a dict."""
+        coroutines = sorted(self.coroutines.items(), key=lambda item: item[1][2], reverse=True)
+        functions = sorted(self.functions.items(), key=lambda item: item[1][2], reverse=True)
+        return {
+            'slow_steps': self.slow_steps,
+            'coroutines': [{'handle': handle, 'name': name, 'switches': switches,
+                            'cpu': round(cpu, 6), 'wall': round(wall, 6), 'max_step': round(max_step, 6)}
+                           for handle, (name, switches, cpu, wall, max_step) in coroutines[:limit]],
+            'functions': [{'name': name, 'coroutines': number, 'switches': switches,
+                           'cpu': round(cpu, 6), 'wall': round(wall, 6), 'max_step': round(max_step, 6)}
+                          for name, (number, switches, cpu, wall, max_step) in functions[:limit]],
+        }
+
+
+def enable(threshold=0.1, watchdog=True):
+    """Enables profiling of coroutines, call it in the loop thread; returns the profiler."""
+    if coroutine._profiler is None:
+        coroutine._profiler = Profiler(threshold, watchdog)
+    return coroutine._profiler
+
+
+def disable():
+    """Disables profiling of coroutines."""
+    if coroutine._profiler is not None:
+        coroutine._profiler.stop()
+        coroutine._profiler = None
+
+
+def report(limit=10):
+    """Returns current report, None if profiling is disabled."""
+    return coroutine._profiler.report(limit) if coroutine._profiler is not None else None
@@ -0,0 +1,266 @@
+"""`squall.resolver`"""
+import os
+import socket
+import struct
+import random
+from time import monotonic as now
+from squall.utilites import log, timeout_gen
+from squall.dispatcher import dispatcher
+from squall.coroutine import coroutine, READ, TIMEOUT
+
+_QTYPES = {socket.AF_INET: 1, socket.AF_INET6: 28}
+
+
+def _query(qid, name, qtype):
+    # DNS query packet with the recursion desired flag
+    labels = name.encode('idna').split(b'.')
+    qname = b''.join(bytes([len(label)]) + label for label in labels if label) + b'\0'
+    return struct.pack('!HHHHHH', qid, 0x0100, 1, 0, 0, 0) + qname + struct.pack('!HH', qtype, 1)
+
+
+def _skip_name(data, offset):
+    while True:
+        length = data[offset]
+        if length == 0:
+            return offset + 1
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += length + 1
+
+
+def _parse(data):
+    # returns (qid, rcode, truncated, [(family, address, ttl), ...])
+    qid, flags, qdcount, ancount, _, _ = struct.unpack_from('!HHHHHH', data)
+    offset = 12
+    for _ in range(qdcount):
+        offset = _skip_name(data, offset) + 4
+    records = list()
+    for _ in range(ancount):
+        offset = _skip_name(data, offset)
+        rtype, _, ttl, rdlength = struct.unpack_from('!HHIH', data, offset)
+        offset += 10
+        rdata = data[offset:offset+rdlength]
+        offset += rdlength
+        if rtype == 1 and rdlength == 4:
+            records.append((socket.AF_INET, socket.inet_ntop(socket.AF_INET, rdata), ttl))
+        elif rtype == 28 and rdlength == 16:
+            records.append((socket.AF_INET6, socket.inet_ntop(socket.AF_INET6, rdata), ttl))
+    return qid, flags & 0x000F, bool(flags & 0x0200), records
+
+
+class Resolver(object):
+    """Non-blocking resolver with TTL cache.
+
+    Names are looked up in the hosts file, then asked from nameservers
+    with DNS over UDP, with the search domains applied as the system
+    resolver does; if there is no answer, or a name with fewer dots than
+    ndots is not found, `socket.getaddrinfo` is called in the thread pool.
+    """
+    def __init__(self, nameservers=None, hosts_path='/etc/hosts', timeout=2.0, attempts=2,
+                 max_ttl=300, negative_ttl=5, fallback_ttl=30, search=None, ndots=None):
+        self.timeout = timeout
+        self.attempts = attempts
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.fallback_ttl = fallback_ttl
+        self.hosts_path = hosts_path
+        self._nameservers = nameservers
+        self._search = search
+        self._ndots = ndots
+        self._hosts = None
+        self._hosts_mtime = None
+        self._cache = dict()
+
+    def _read_resolv_conf(self):
+        nameservers, search, ndots = list(), list(), 1
+        try:
+            with open('/etc/resolv.conf') as resolv_conf:
+                for line in resolv_conf:
+                    fields = line.split()
+                    if len(fields) < 2:
+                        continue
+                    if fields[0] == 'nameserver':
+                        nameservers.append(fields[1])
+                    elif fields[0] in ('search', 'domain'):
+                        # the last one of them wins
+                        search = fields[1:]
+                    elif fields[0] == 'options':
+                        for option in fields[1:]:
+                            if option.startswith('ndots:') and option[6:].isdigit():
+                                ndots = min(int(option[6:]), 15)
+        except OSError:
+            pass
+        if self._nameservers is None:
+            self._nameservers = nameservers
+        if self._search is None:
+            self._search = search
+        if self._ndots is None:
+            self._ndots = ndots
+
+    @property
+    def nameservers(self):
+        """Nameserver addresses, read from /etc/resolv.conf by default."""
+        if self._nameservers is None:
+            self._read_resolv_conf()
+        return [(server, 53) if isinstance(server, str) else tuple(server) for server in self._nameservers]
+
+    @property
+    def search(self):
+        """Search domains, read from /etc/resolv.conf by default."""
+        if self._search is None:
+            self._read_resolv_conf()
+        return [domain.lower().strip('.') for domain in self._search]
+
+    @property
+    def ndots(self):
+        """Dots in a name to query it as is before the search domains, read from /etc/resolv.conf by default."""
+        if self._ndots is None:
+            self._read_resolv_conf()
+        return self._ndots
+
+    def _candidates(self, name, absolute):
+        # names to query in order, as the system resolver does
+        if absolute:
+            return [name]
+        searched = ['{}.{}'.format(name, domain) for domain in self.search if domain]
+        if name.count('.') >= self.ndots:
+            return [name] + searched
+        return searched + [name]
+
+    def _lookup_hosts(self, name, family):
+        try:
+            mtime = os.stat(self.hosts_path).st_mtime
+        except OSError:
+            return None
+        if mtime != self._hosts_mtime:
+            self._hosts, self._hosts_mtime = dict(), mtime
+            with open(self.hosts_path) as hosts_file:
+                for line in hosts_file:
+                    fields = line.split('#', 1)[0].split()
+                    if len(fields) < 2:
+                        continue
+                    address_family = socket.AF_INET6 if ':' in fields[0] else socket.AF_INET
+                    for host in fields[1:]:
+                        self._hosts.setdefault(host.lower(), list()).append((address_family, fields[0]))
+        addresses = [entry for entry in self._hosts.get(name, ()) if family in (socket.AF_UNSPEC, entry[0])]
+        return addresses or None
+
+    def _exchange(self, nameserver, queries):
+        # sends all queries to nameserver at once and waits for their answers
+        family = socket.AF_INET6 if ':' in nameserver[0] else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        answers = dict()
+        try:
+            sock.connect(nameserver)
+            for packet in queries.values():
+                sock.send(packet)
+            timeout = timeout_gen(self.timeout)
+            while len(answers) < len(queries):
+                try:
+                    data = sock.recv(4096)
+                except BlockingIOError:
+                    remained = next(timeout)
+                    if remained is not None and remained <= 0:
+                        break
+                    revents = yield from coroutine.wait(sock.fileno(), READ, remained)
+                    if revents & TIMEOUT:
+                        break
+                    continue
+                try:
+                    answer = _parse(data)
+                except (struct.error, IndexError, ValueError):
+                    continue
+                if answer[0] in queries:
+                    answers[answer[0]] = answer
+        finally:
+            dispatcher.release(sock.fileno())
+            sock.close()
+        return answers
+
+    def _query_nameservers(self, name, family):
+        # returns [(family, address, ttl), ...], [] if the name is not found or None if no answer
+        qtypes = [_QTYPES[family]] if family in _QTYPES else [1, 28]
+        for _ in range(self.attempts):
+            for nameserver in self.nameservers:
+                qids = random.sample(range(0x10000), len(qtypes))
+                queries = {qid: _query(qid, name, qtype) for qid, qtype in zip(qids, qtypes)}
+                try:
+                    answers = yield from self._exchange(nameserver, queries)
+                except OSError as exc:
+                    log.debug("Nameserver {} has failed: {}.".format(nameserver, exc))
+                    continue
+                if len(answers) < len(queries):
+                    continue
+                records = list()
+                for _, rcode, truncated, answer_records in answers.values():
+                    if truncated or rcode not in (0, 3):
+                        return None
+                    records.extend(answer_records)
+                return records
+        return None
+
+    def resolve(self, host, family=socket.AF_UNSPEC):
+        """Returns list of (family, address) of host; raises `socket.gaierror` if not found."""
+        name = host.lower().rstrip('.')
+        absolute = host.endswith('.')
+        # an absolute name is not searched, so it has an answer of its own
+        key = (name, family, absolute)
+        cached = self._cache.get(key)
+        if cached is not None:
+            if cached[0] > now():
+                if cached[1] is None:
+                    raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+                return cached[1]
+            del self._cache[key]
+        addresses = self._lookup_hosts(name, family)
+        if addresses is not None:
+            return addresses
+        for candidate in self._candidates(name, absolute):
+            records = yield from self._query_nameservers(candidate, family)
+            if records != []:
+                # found or no answer, the next candidate is asked only if not found
+                break
+        if records is None or (not records and not absolute and name.count('.') < self.ndots):
+            # a short name may be known to other sources of the system resolver
+            try:
+                addrinfo = yield from coroutine.run_in_executor(
+                    socket.getaddrinfo, name, None, family, socket.SOCK_STREAM)
+            except socket.gaierror:
+                self._cache[key] = (now() + self.negative_ttl, None)
+                raise
+            addresses = list()
+            for address_family, _, _, _, address in addrinfo:
+                if (address_family, address[0]) not in addresses:
+                    addresses.append((address_family, address[0]))
+            ttl = self.fallback_ttl
+        elif not records:
+            self._cache[key] = (now() + self.negative_ttl, None)
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        else:
+            addresses = [(address_family, address) for address_family, address, _ in records]
+            ttl = min(min(ttl for _, _, ttl in records), self.max_ttl)
+        if ttl > 0:
+            self._cache[key] = (now() + ttl, addresses)
+        return addresses
+
+    def getaddrinfo(self, host, port, family=socket.AF_UNSPEC, type=socket.SOCK_STREAM, proto=0, flags=0):
+        """Non-blocking `socket.getaddrinfo`."""
+        try:
+            # numeric and local addresses are resolved without any lookup
+            return socket.getaddrinfo(host, port, family, type, proto, flags | socket.AI_NUMERICHOST)
+        except socket.gaierror:
+            if host is None:
+                raise
+        if isinstance(port, str):
+            port = int(port) if port.isdigit() else socket.getservbyname(port)
+        proto = proto or {socket.SOCK_STREAM: socket.IPPROTO_TCP,
+                          socket.SOCK_DGRAM: socket.IPPROTO_UDP}.get(type, 0)
+        result = list()
+        for address_family, address in (yield from self.resolve(host, family)):
+            sockaddr = (address, port) if address_family == socket.AF_INET else (address, port, 0, 0)
+            result.append((address_family, type, proto, '', sockaddr))
+        return result
+
+
+resolver = Resolver()
@@ -1,6 +1,11 @@
 """`squall.scgi2wsgi`"""
 import io
-import errno
+import os
+import stat
+import codecs
+import tempfile
+import functools
+import threading
 import collections
 from squall.network import stream
 from squall.coroutine import coroutine
@@ -20,73 +25,214 @@ class ErrorStream(object):
         pass
 
 
-class InputStream(io.BytesIO):
-    """WSGI input stream adapter."""
-    def __init__(self, environ, timeout):
+class InputStream(io.RawIOBase):
+    """WSGI input stream adapter.
+
+    The body is stored in a temporary file spooled in memory up to
+    spool_size bytes. While it is arriving a read in the thread pool
+    blocks until enough bytes have been received.
+    """
+    def __init__(self, environ, timeout, spool_size=1024*1024):
         self._timeout = timeout
-        self._content_length = int(environ.get('CONTENT_LENGTH', '0'))
+        self._content_length = int(environ.get('CONTENT_LENGTH') or '0')
+        self._loaded = self._content_length == 0
+        self._streaming = False
+        self._error = None
+        self._spool_size = spool_size
+        self._body = None
+        self._position = self._received = 0
+        self._ready = threading.Condition()
         environ['squall.async_body_loader'] = self._async_body_loader
         super(InputStream, self).__init__()
 
+    def readable(self):
+        return True
+
+    def _append(self, data):
+        with self._ready:
+            if self._body is None:
+                self._body = tempfile.SpooledTemporaryFile(max_size=self._spool_size)
+            self._body.seek(self._received)
+            self._body.write(data)
+            self._received += len(data)
+            self._ready.notify_all()
+
+    def _finish(self, error=None):
+        with self._ready:
+            self._loaded = error is None
+            self._error = error
+            self._streaming = False
+            self._ready.notify_all()
+
+    def _available(self, number):
+        # waits, only if the body is streaming to the thread pool, until
+        # number of bytes are available; returns the available number
+        while self._streaming and self._received - self._position < number:
+            self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        return self._received - self._position
+
+    def read(self, size=-1):
+        with self._ready:
+            if size is None or size < 0:
+                while self._streaming:
+                    self._ready.wait()
+                size = self._available(0)
+            else:
+                size = min(size, self._available(size))
+            if not size:
+                return b''
+            self._body.seek(self._position)
+            data = self._body.read(size)
+            self._position += len(data)
+            return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def readline(self, size=-1):
+        line = b''
+        with self._ready:
+            while not line.endswith(b'\n') and (size is None or size < 0 or len(line) < size):
+                available = self._available(1)
+                if not available:
+                    break
+                limit = available if size is None or size < 0 else min(available, size - len(line))
+                self._body.seek(self._position)
+                part = self._body.readline(limit)
+                self._position += len(part)
+                line += part
+        return line
+
+    def close(self):
+        if self._body is not None:
+            self._body.close()
+        super(InputStream, self).close()
+
     def _async_body_loader(self, callback=None):
-            remained = self._content_length
-            callback = callback or (lambda current, total: True)
+        remained = self._content_length
+        callback = callback or (lambda current, total: True)
+        try:
             while remained > 0:
                 block_size = stream.chunk_size if stream.chunk_size < remained else remained
                 data = yield from stream.read(block_size, next(self._timeout))
+                if not data:
+                    raise ConnectionError("Unexpected end of request body")
                 remained -= len(data)
                 if callback(self._content_length-remained, self._content_length):
-                    self.write(data)
-            self.seek(0)
+                    self._append(data)
+        except BaseException as exc:
+            self._finish(ConnectionError("Cannot receive request body: {!r}".format(exc)))
+            raise
+        stream.setDeadline(None)
+        self._finish()
+
+
+_error_stream = ErrorStream()
+
+
+class FileWrapper(object):
+    """WSGI file wrapper, a real file is sent with `sendfile` without copying.
+
+    The file is sent from offset, its current position by default, and
+    up to length bytes, to its end by default.
+    """
+    def __init__(self, filelike, block_size=8192, offset=None, length=None):
+        self.filelike = filelike
+        self.block_size = block_size
+        self.offset = offset
+        self.length = length
+        if hasattr(filelike, 'close'):
+            self.close = filelike.close
+
+    def __iter__(self):
+        if self.offset is not None:
+            self.filelike.seek(self.offset)
+        remained = self.length
+        while remained is None or remained > 0:
+            block_size = self.block_size if remained is None or remained > self.block_size else remained
+            data = self.filelike.read(block_size)
+            if not data:
+                break
+            if remained is not None:
+                remained -= len(data)
+            yield data
+
+    def _sendfile_args(self):
+        # returns (fd, offset, length) for a regular file, otherwise None
+        try:
+            fd = self.filelike.fileno()
+            status = os.fstat(fd)
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            return None
+        if not stat.S_ISREG(status.st_mode):
+            return None
+        offset = self.offset if self.offset is not None else self.filelike.tell()
+        length = status.st_size - offset if offset < status.st_size else 0
+        length = length if self.length is None or self.length > length else self.length
+        return fd, offset, length
+
+
+class GatewayState(object):
+    """State of a gateway request, held by the context of its coroutine."""
+    __slots__ = ('headers_sent', 'out_headers', 'chunk_size', 'buffer_size', 'captured', 'capture_limit')
+
+    def __init__(self, chunk_size, buffer_size):
+        self.headers_sent = False
+        self.out_headers = []
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+        self.captured = None
+        self.capture_limit = 0
+
 
 class Gateway(type):
     """SCGI2WSGI Gateway API hub"""
+    _state_class = GatewayState
+
     def __init__(cls, *args):
         cls._state = dict()
+        # every request environ is a copy of this prebuilt template
+        cls._environ_template = dict(cls._default_environ, **{'wsgi.errors': _error_stream})
         super(Gateway, cls).__init__(*args)
 
+    @property
+    def _instance(cls):
+        context = coroutine.context
+        return context.gateway if context is not None else None
+
     @property
     def _headers_sent(cls):
-        handle = coroutine.current
-        return cls._state[handle][0] if handle is not None else None
+        instance = cls._instance
+        return instance.headers_sent if instance is not None else None
 
     @_headers_sent.setter
     def _headers_sent(cls, value):
-        handle = coroutine.current
-        if handle is not None:
-            cls._state[handle][0] = value
+        instance = cls._instance
+        if instance is not None:
+            instance.headers_sent = value
         else:
             raise AttributeError
 
     @property
     def _out_headers(cls):
-        handle = coroutine.current
-        return cls._state[handle][1] if handle is not None else None
-
-    @property
-    def _out_buffer(cls):
-        handle = coroutine.current
-        return cls._state[handle][2] if handle is not None else None
-
-    @_out_buffer.setter
-    def _out_buffer(cls, value):
-        handle = coroutine.current
-        if handle is not None:
-            cls._state[handle][2] = value
-        else:
-            raise AttributeError
+        instance = cls._instance
+        return instance.out_headers if instance is not None else None
 
     @property
     def chunk_size(cls):
         """Buffer chunk size of current stream."""
-        handle = coroutine.current
-        return cls._state[handle][3] if handle is not None else None
+        instance = cls._instance
+        return instance.chunk_size if instance is not None else None
 
     @property
     def buffer_size(cls):
         """Buffer size of current stream."""
-        handle = coroutine.current
-        return cls._state[handle][4] if handle is not None else None
+        instance = cls._instance
+        return instance.buffer_size if instance is not None else None
 
     @property
     def _default_environ(cls):
@@ -95,20 +241,48 @@ class Gateway(type):
             'wsgi.multithread': False,
             'wsgi.multiprocess': True,
             'wsgi.run_once': True,
+            'wsgi.file_wrapper': FileWrapper,
         }
 
-    def _read_environ(cls, input_async, timeout):
+    def _read_environ(cls, input_async, timeout, header_timeout=None, body_timeout=None,
+                      max_header_size=64*1024):
         timeout = timeout_gen(timeout)
-        data = yield from stream.readUntil(b':', 12, next(timeout))
-        if data[-1] != 58:
+        if header_timeout is not None:
+            stream.setDeadline(header_timeout)
+        instance = stream._instance
+        buffer = instance.in_buffer
+        # the netstring is parsed in place in the connection buffer
+        while True:
+            pos = buffer.find(b':')
+            if pos >= 0 or len(buffer) >= 12 or instance.eof:
+                break
+            yield from stream._fill_in_buff(instance, timeout)
+        if pos < 0:
+            if not len(buffer):
+                # connection closed without any request
+                return None
+            raise ValueError("Wrong SCGI header size")
+        size = bytes(buffer.view(pos))
+        if not size.isdigit() or int(size) >= max_header_size:
             raise ValueError("Wrong SCGI header size")
-        data = yield from stream.read(int(data[:-1])+1, next(timeout))
-        if data[-1] != 44:
+        size = int(size) + 1
+        buffer.skip(pos + 1)
+        if size > buffer.size:
+            data = bytearray(size)
+            if (yield from stream.read_into(data, next(timeout))) < size:
+                raise ValueError("Wrong SCGI header")
+            header = memoryview(data)
+        else:
+            while len(buffer) < size and not instance.eof:
+                yield from stream._fill_in_buff(instance, timeout)
+            header = buffer.view(size)
+        if len(header) < size or header[-1] != 44:
             raise ValueError("Wrong SCGI header")
-        environ = dict(cls._default_environ)
-        parts = [part.decode('iso-8859-1') for part in data[:-1].split(b"\000")]
-        environ.update(dict(zip(parts[0::2], parts[1::2])))
-        environ['wsgi.errors'] = ErrorStream()
+        # decodes the whole header block at once
+        parts = codecs.latin_1_decode(header[:-1])[0].split('\0')
+        buffer.skip(size)
+        environ = cls._environ_template.copy()
+        environ.update(zip(parts[0::2], parts[1::2]))
         environ['wsgi.input'] = InputStream(environ, timeout)
         if 'PATH_INFO' not in environ:
             if 'SCRIPT_NAME' not in environ:
@@ -120,30 +294,73 @@ class Gateway(type):
             environ['wsgi.url_scheme'] = 'https'
         else:
             environ['wsgi.url_scheme'] = 'http'
-
+        if header_timeout is not None or body_timeout is not None:
+            # the body budget replaces the header one
+            stream.setDeadline(None if environ['wsgi.input']._loaded else body_timeout)
         if not input_async:
             yield from environ['squall.async_body_loader']()
             del environ['squall.async_body_loader']
         return environ
 
     def _start_response(cls, status, response_headers, exc_info=None):
+        cls._set_response(cls._instance, status, response_headers, exc_info)
+
+    def _set_response(cls, instance, status, response_headers, exc_info=None):
+        # instance is passed explicitly, so it works in the thread pool also
         if exc_info:
             try:
-                if cls._headers_sent:
+                if instance.headers_sent:
                     raise exc_info[1].with_traceback(exc_info[2])
             finally:
                 exc_info = None
-        elif cls._out_headers:
+        elif instance.out_headers:
             raise AssertionError("Headers already set!")
-        cls._out_headers.append(('Status', status))
+        instance.out_headers.append(('Status', status))
         for name, value in response_headers:
-            cls._out_headers.append((name, value))
+            instance.out_headers.append((name, value))
+
+    def _run_threaded(cls, application, environ):
+        environ['wsgi.multithread'] = True
+        start_response = functools.partial(cls._set_response, cls._instance)
+        body_loader = environ.pop('squall.async_body_loader', None)
+        input_stream = environ['wsgi.input']
+        if body_loader is not None and not input_stream._loaded:
+            # the application starts while the body is still arriving,
+            # its reads block in the thread pool until data is received
+            input_stream._streaming = True
+            future = coroutine.executor.submit(application, environ, start_response)
+            yield from body_loader()
+            app_iter = yield from coroutine.wait_future(future)
+        else:
+            app_iter = yield from coroutine.run_in_executor(application, environ, start_response)
+        if isinstance(app_iter, (bytes, bytearray, list, tuple, FileWrapper)):
+            yield from cls._out_response(app_iter)
+            return
+        # every next chunk is produced in the thread pool only after
+        # the previous one has been written, that is the flow control
+        try:
+            iterator = iter(app_iter)
+            while True:
+                chunk = yield from coroutine.run_in_executor(next, iterator, None)
+                if chunk is None:
+                    break
+                if not isinstance(chunk, bytes):
+                    raise ValueError("WSGI Application return wrong type of app_iter items: {}".format(type(chunk)))
+                if not cls._headers_sent:
+                    yield from cls._out_head()
+                yield from cls._write(chunk)
+        except BaseException:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+            raise
+        if hasattr(app_iter, 'close'):
+            yield from coroutine.run_in_executor(app_iter.close)
 
     def _out_head(cls):
         if not cls._headers_sent:
-            for name, value in cls._out_headers:
-                yield from cls._write('{}: {}\r\n'.format(name, value).encode('iso-8859-1'))
-            yield from cls._write(b'\r\n', True)
+            # headers are queued to go out together with the first body chunk
+            head = ''.join('{}: {}\r\n'.format(name, value) for name, value in cls._out_headers)
+            yield from cls._write((head + '\r\n').encode('iso-8859-1'))
             cls._headers_sent = True
 
     def _out_generator(cls, app_iter):
@@ -151,6 +368,7 @@ class Gateway(type):
             chunk = next(app_iter)
             while True:
                 if chunk is None:
+                    yield from cls._write(flush=True)
                     event = yield
                 else:
                     event = None
@@ -170,8 +388,28 @@ class Gateway(type):
             if hasattr(app_iter, 'close'):
                 app_iter.close()
 
+    def _out_file(cls, file_wrapper):
+        try:
+            sendfile_args = file_wrapper._sendfile_args()
+            if sendfile_args is None:
+                yield from cls._out_response(iter(file_wrapper))
+            else:
+                if not cls._headers_sent:
+                    yield from cls._out_head()
+                yield from cls._write_file(*sendfile_args)
+        finally:
+            if hasattr(file_wrapper, 'close'):
+                file_wrapper.close()
+
+    def _write_file(cls, fd, offset, length):
+        # a file sent with sendfile cannot be captured for the cache
+        cls._instance.captured = None
+        yield from stream.sendfile(fd, offset, length)
+
     def _out_response(cls, app_iter):
-        if hasattr(app_iter, 'send'):
+        if isinstance(app_iter, FileWrapper):
+            yield from cls._out_file(app_iter)
+        elif hasattr(app_iter, 'send'):
             yield from cls._out_generator(app_iter)
         else:
             if isinstance(app_iter, bytearray):
@@ -190,55 +428,83 @@ class Gateway(type):
                 app_iter.close()
 
     def _write(cls, data=b'', flush=False):
-        flush = flush if cls.buffer_size > 0 else True
-        buffer_size = cls.buffer_size or cls.chunk_size * 8
-        max_buffer_size = buffer_size * 4
-        if (len(cls._out_buffer)+len(data)) > max_buffer_size:
-            raise OSError(errno.ENOBUFS, "No buffer space available.")
-        cls._out_buffer += data
-        if len(cls._out_buffer) == 0:
-            return
-        # send
-        countdown = 8
-        while countdown > 0:
-            if flush:
-                while (countdown > 0) and len(cls._out_buffer):
-                    sent = yield from stream.write(cls._out_buffer[:cls.chunk_size])
-                    if sent:
-                        cls._out_buffer = cls._out_buffer[sent:]
-                        countdown = 8
-                    else:
-                        countdown -= 1
-                break
+        instance = cls._instance
+        flush = flush if instance.buffer_size > 0 else True
+        if instance.captured is not None and len(data):
+            if len(instance.captured) + len(data) > instance.capture_limit:
+                instance.captured = None
             else:
-                while (countdown > 0) and (len(cls._out_buffer) > buffer_size):
-                    sent = yield from stream.write(cls._out_buffer[:cls.chunk_size])
-                    if sent:
-                        cls._out_buffer = cls._out_buffer[sent:]
-                        countdown = 8
-                    else:
-                        countdown -= 1
-                break
-        if countdown == 0:
-            raise OSError(errno.ECOMM, "Cannot send response.")
+                instance.captured += data
+        yield from stream.write(data, flush=flush)
+
+    def _run_application(cls, application, environ, threaded):
+        if threaded:
+            yield from cls._run_threaded(application, environ)
+        else:
+            yield from cls._out_response(application(environ, cls._start_response))
+        if not cls._headers_sent:
+            yield from cls._out_head()
+
+    def _run_cached(cls, cache, application, environ, threaded):
+        key = cache.key(environ)
+        data = None
+        if key is not None:
+            data = cache.get(key)
+            if data is None and key in cache._pending:
+                # the same response is being computed by another coroutine
+                data = yield from cache._wait(key)
+        if data is not None:
+            # the stored head and body bytes are written as they are
+            cls._headers_sent = True
+            yield from cls._write(data)
+            return
+        leader = key is not None and key not in cache._pending
+        instance = cls._instance
+        stored = None
+        if leader:
+            cache._lead(key)
+            instance.captured = bytearray()
+            instance.capture_limit = cache.max_entry_size
+        try:
+            yield from cls._run_application(application, environ, threaded)
+            if leader and instance.captured is not None:
+                data = bytes(instance.captured)
+                if cache.put(key, instance.out_headers, data):
+                    stored = data
+        finally:
+            instance.captured = None
+            if leader:
+                cache._done(key, stored)
 
     def _init_instance(cls, handle, chunk_size, buffer_size):
         chunk_size = chunk_size if chunk_size > 1024 else 1024
         chunk_size = chunk_size if chunk_size < 64*1024 else 64*1024
-        cls._state[handle] = [False, [], b'', chunk_size, buffer_size]
+        instance = cls._state_class(chunk_size, buffer_size)
+        coroutine._context(handle).gateway = cls._state[handle] = instance
 
     def _release_instance(cls, handle):
         del cls._state[handle]
+        if handle in coroutine._all:
+            coroutine._all[handle].gateway = None
 
 
 
 class wsgi(metaclass=Gateway):
     """Makes application coroutine from a function or method."""
-    def __init__(self, run=None, chunk_size=None, buffer_size=None, timeout=None, input_async=False):
+    def __init__(self, run=None, chunk_size=None, buffer_size=None, timeout=None, input_async=False, nodelay=None,
+                 threaded=False, cache=None, header_timeout=None, body_timeout=None, idle_timeout=None,
+                 max_header_size=64*1024):
         self._run = run
         self._obj = self._coro = None
+        self.nodelay = nodelay
         self.timeout = timeout
-        self.input_async = input_async
+        self.header_timeout = header_timeout
+        self.body_timeout = body_timeout
+        self.idle_timeout = idle_timeout
+        self.max_header_size = max_header_size
+        self.threaded = threaded
+        self.cache = cache
+        self.input_async = input_async and not threaded
         self.chunk_size = chunk_size or 4*1024
         self.buffer_size = buffer_size if buffer_size is not None else 256*1024
         super(wsgi, self).__init__()
@@ -252,17 +518,28 @@ class wsgi(metaclass=Gateway):
             application = functools.partial(self._run, self._obj) if self._obj else self._run
             if self._coro is None:
                 # application coroutine wrapper
+                @functools.wraps(self._run)
                 def wrapper(address):
                     handle = coroutine.current
                     wsgi._init_instance(handle, self.chunk_size, self.buffer_size)
-                    environ = yield from wsgi._read_environ(self.input_async, self.timeout)
-                    yield from wsgi._out_response(application(environ, wsgi._start_response))
-                    if not wsgi._headers_sent:
-                        yield from wsgi._out_head()
-                    else:
+                    try:
+                        try:
+                            environ = yield from wsgi._read_environ(self.input_async or self.threaded, self.timeout,
+                                                                    self.header_timeout, self.body_timeout,
+                                                                    self.max_header_size)
+                        except TimeoutError:
+                            environ = None
+                        if environ is None:
+                            return
+                        if self.cache is not None:
+                            yield from wsgi._run_cached(self.cache, application, environ, self.threaded)
+                        else:
+                            yield from wsgi._run_application(application, environ, self.threaded)
                         yield from wsgi._write(flush=True)
-                    wsgi._release_instance(handle)
-                self._coro = stream(wrapper, self.chunk_size, self.buffer_size)
+                        environ['wsgi.input'].close()
+                    finally:
+                        wsgi._release_instance(handle)
+                self._coro = stream(wrapper, self.chunk_size, self.buffer_size, self.nodelay, self.idle_timeout)
             return self._coro(*args, **kwargs)
         else:
             self._run = args[0]
@@ -0,0 +1,140 @@
+"""`squall.stats`"""
+import json
+from time import perf_counter
+from squall.dispatcher import dispatcher
+from squall.coroutine import coroutine
+from squall.network import stream, streamServer
+
+
+class Stats(object):
+    """Event loop statistics collector.
+
+    It is called by the dispatcher at the phases of every loop iteration
+    only while it is enabled, so disabled statistics cost a single
+    attribute check per iteration.
+    """
+    BUCKETS = 32
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Resets all counters."""
+        self.iterations = 0
+        self.busy_time = 0.0
+        self.poll_time = 0.0
+        self.callbacks = 0
+        self.max_callbacks = 0
+        self.events = 0
+        self.max_events = 0
+        self.max_idles = 0
+        self.max_pending = 0
+        self.max_timeouts = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        # log2 buckets of iteration busy time in microseconds
+        self.latency = [0] * self.BUCKETS
+        self._callbacks = 0
+        self._started = self._poll_started = self._poll_finished = perf_counter()
+
+    def begin(self, idles):
+        self._started = perf_counter()
+        if idles > self.max_idles:
+            self.max_idles = idles
+
+    def polling(self, callbacks, pending, timeouts):
+        self._poll_started = perf_counter()
+        # idle callbacks executed within the budgets, the rest wait for next iterations
+        self._callbacks = callbacks
+        if pending > self.max_pending:
+            self.max_pending = pending
+        if timeouts > self.max_timeouts:
+            self.max_timeouts = timeouts
+
+    def polled(self, events):
+        self._poll_finished = perf_counter()
+        self._callbacks += events
+        self.events += events
+        if events > self.max_events:
+            self.max_events = events
+
+    def end(self, expired):
+        finished = perf_counter()
+        busy = (self._poll_started - self._started) + (finished - self._poll_finished)
+        callbacks = self._callbacks + expired
+        self.iterations += 1
+        self.busy_time += busy
+        self.poll_time += self._poll_finished - self._poll_started
+        self.callbacks += callbacks
+        if callbacks > self.max_callbacks:
+            self.max_callbacks = callbacks
+        bucket = int(busy * 1e6).bit_length()
+        self.latency[bucket if bucket < self.BUCKETS else self.BUCKETS - 1] += 1
+
+    def _percentile(self, percent):
+        threshold = self.iterations * percent / 100
+        counted = 0
+        for bucket, count in enumerate(self.latency):
+            counted += count
+            if count and counted >= threshold:
+                return 1 << bucket
+        return 0
+
+    def snapshot(self):
+        """Returns statistics as a dict."""
+        iterations = self.iterations or 1
+        return {
+            'iterations': self.iterations,
+            'busy_time': round(self.busy_time, 6),
+            'poll_time': round(self.poll_time, 6),
+            'callbacks': self.callbacks,
+            'callbacks_per_iteration': round(self.callbacks / iterations, 3),
+            'max_callbacks': self.max_callbacks,
+            'events': self.events,
+            'events_per_poll': round(self.events / iterations, 3),
+            'max_events': self.max_events,
+            'idles': dispatcher.queued,
+            'max_idles': self.max_idles,
+            'pending': len(dispatcher._pending),
+            'max_pending': self.max_pending,
+            'timeouts': len(dispatcher._timeouts) - dispatcher._cancelled,
+            'max_timeouts': self.max_timeouts,
+            'coroutines': len(coroutine._all),
+            'streams': len(stream._ci),
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'iteration_us': {
+                'p50': self._percentile(50),
+                'p99': self._percentile(99),
+                'histogram': {'<{}'.format(1 << bucket): count
+                              for bucket, count in enumerate(self.latency) if count},
+            },
+        }
+
+
+def enable():
+    """Enables statistics of the dispatcher, returns the collector."""
+    if dispatcher._stats is None:
+        dispatcher._stats = Stats()
+    return dispatcher._stats
+
+
+def disable():
+    """Disables statistics of the dispatcher."""
+    dispatcher._stats = None
+
+
+def snapshot():
+    """Returns current statistics, None if they are disabled."""
+    return dispatcher._stats.snapshot() if dispatcher._stats is not None else None
+
+
+@stream
+def _admin(address):
+    yield from stream.write(json.dumps(snapshot()).encode() + b'\n')
+
+
+def serve(address, backlog=8):
+    """Enables statistics and serves them as JSON on the local admin socket."""
+    enable()
+    return streamServer(_admin, address, backlog)
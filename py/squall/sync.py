@@ -0,0 +1,279 @@
+"""`squall.sync`"""
+import functools
+from collections import deque
+from concurrent.futures import CancelledError
+from squall.utilites import timeout_gen
+from squall.dispatcher import dispatcher
+from squall.coroutine import coroutine
+
+
+class Waiters(object):
+    """FIFO of parked coroutines.
+
+    A parked coroutine holds neither fd nor timer, unless timeout is
+    given; it is resumed through the idle callbacks of the dispatcher.
+    """
+    def __init__(self):
+        self._queue = deque()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def wait(self, timeout=None):
+        """Parks current coroutine until `wakeup`; returns False if timeout has expired."""
+        assert coroutine.current is not None, "Can called only from coroutine."
+        if timeout is not None and timeout <= 0:
+            return False
+        waiter = [coroutine.current, None]
+
+        def expire(revents):
+            self._queue.remove(waiter)
+            coroutine.switch(waiter[0], False)
+
+        if timeout is not None:
+            waiter[1] = dispatcher.watch(expire, timeout=timeout)
+        self._queue.append(waiter)
+        try:
+            return (yield)
+        except:
+            if waiter in self._queue:
+                self._queue.remove(waiter)
+                if waiter[1] is not None:
+                    dispatcher.cancel(waiter[1])
+            waiter[0] = None
+            raise
+
+    def wakeup(self):
+        """Resumes the first parked coroutine; returns False if there is none."""
+        if not self._queue:
+            return False
+        waiter = self._queue.popleft()
+        if waiter[1] is not None:
+            dispatcher.cancel(waiter[1])
+        dispatcher.call(functools.partial(self._resume, waiter))
+        return True
+
+    def wakeup_all(self):
+        """Resumes all parked coroutines."""
+        while self.wakeup():
+            pass
+
+    def _resume(self, waiter, revents):
+        if waiter[0] is not None:
+            coroutine.switch(waiter[0], True)
+        else:
+            # the waiter has gone meanwhile, the wakeup is passed on
+            self.wakeup()
+
+
+class Event(object):
+    """Event flag for coroutines."""
+    def __init__(self):
+        self._flag = False
+        self._waiters = Waiters()
+
+    def is_set(self):
+        """True if the flag is set."""
+        return self._flag
+
+    def set(self):
+        """Sets the flag and resumes all waiting coroutines."""
+        self._flag = True
+        self._waiters.wakeup_all()
+
+    def clear(self):
+        """Resets the flag."""
+        self._flag = False
+
+    def wait(self, timeout=None):
+        """Pauses current coroutine until the flag is set; returns the flag."""
+        timeout = timeout_gen(timeout)
+        while not self._flag:
+            if not (yield from self._waiters.wait(next(timeout))):
+                break
+        return self._flag
+
+
+class Semaphore(object):
+    """Counting semaphore for coroutines."""
+    def __init__(self, value=1):
+        self._value = value
+        self._waiters = Waiters()
+
+    @property
+    def value(self):
+        """Number of available permits."""
+        return self._value
+
+    def locked(self):
+        """True if acquire would wait."""
+        return self._value <= 0
+
+    def acquire(self, timeout=None):
+        """Pauses current coroutine until a permit is taken; returns False on timeout."""
+        timeout = timeout_gen(timeout)
+        while self._value <= 0:
+            if not (yield from self._waiters.wait(next(timeout))):
+                return False
+        self._value -= 1
+        return True
+
+    def release(self):
+        """Returns a permit and resumes the first waiting coroutine."""
+        self._value += 1
+        self._waiters.wakeup()
+
+
+class Condition(object):
+    """Condition variable for coroutines.
+
+    Coroutines are switched only at the yield points, so there is no lock;
+    a woken coroutine must check its predicate again, see `wait_for`.
+    """
+    def __init__(self):
+        self._waiters = Waiters()
+
+    def wait(self, timeout=None):
+        """Pauses current coroutine until notified; returns False on timeout."""
+        return (yield from self._waiters.wait(timeout))
+
+    def wait_for(self, predicate, timeout=None):
+        """Pauses current coroutine until predicate is true; returns its last result."""
+        timeout = timeout_gen(timeout)
+        result = predicate()
+        while not result:
+            if not (yield from self._waiters.wait(next(timeout))):
+                return predicate()
+            result = predicate()
+        return result
+
+    def notify(self, number=1):
+        """Resumes up to number of waiting coroutines."""
+        for _ in range(number):
+            if not self._waiters.wakeup():
+                break
+
+    def notify_all(self):
+        """Resumes all waiting coroutines."""
+        self._waiters.wakeup_all()
+
+
+class Queue(object):
+    """FIFO queue for coroutines, put waits while maxsize items are queued."""
+    def __init__(self, maxsize=0):
+        self.maxsize = maxsize
+        self._items = deque()
+        self._getters = Waiters()
+        self._putters = Waiters()
+
+    def __len__(self):
+        return len(self._items)
+
+    def empty(self):
+        """True if the queue is empty."""
+        return not self._items
+
+    def full(self):
+        """True if put would wait."""
+        return 0 < self.maxsize <= len(self._items)
+
+    def put(self, item, timeout=None):
+        """Pauses current coroutine until there is room and puts item."""
+        timeout = timeout_gen(timeout)
+        while self.full():
+            if not (yield from self._putters.wait(next(timeout))):
+                raise TimeoutError("Queue put timed out.")
+        self.put_nowait(item)
+
+    def put_nowait(self, item):
+        """Puts item; raises IndexError if the queue is full."""
+        if self.full():
+            raise IndexError("Queue is full.")
+        self._items.append(item)
+        self._getters.wakeup()
+
+    def get(self, timeout=None):
+        """Pauses current coroutine until an item is available and returns it."""
+        timeout = timeout_gen(timeout)
+        while not self._items:
+            if not (yield from self._getters.wait(next(timeout))):
+                raise TimeoutError("Queue get timed out.")
+        return self.get_nowait()
+
+    def get_nowait(self):
+        """Returns item; raises IndexError if the queue is empty."""
+        item = self._items.popleft()
+        self._putters.wakeup()
+        return item
+
+
+def join(handle, timeout=None):
+    """Pauses current coroutine until the running coroutine by handle has terminated.
+
+    Returns its result or raises its exception; `CancelledError` if it was
+    closed, `TimeoutError` if timeout has expired. The outcome is not kept
+    after termination, so joining a coroutine that has already terminated
+    raises `ValueError`.
+    """
+    outcome = list()
+    finished = Event()
+
+    def done(result, exception):
+        outcome.append((result, exception))
+        finished.set()
+
+    coroutine.notify(handle, done)
+    if not (yield from finished.wait(timeout)):
+        raise TimeoutError("Join timed out.")
+    result, exception = outcome[0]
+    if isinstance(exception, GeneratorExit):
+        raise CancelledError("Coroutine {:X} was closed.".format(handle))
+    if exception is not None:
+        raise exception
+    return result
+
+
+def gather(tasks, limit=None, return_exceptions=False):
+    """Pauses current coroutine until all tasks have terminated; returns their results in order.
+
+    A task is a handle of running coroutine or a callable that starts one
+    and returns its handle; callables are started so that no more than
+    limit of them run at once. The first exception is raised after all
+    tasks have terminated, unless return_exceptions is set. `ValueError`
+    is raised if a coroutine by handle has already terminated.
+    """
+    tasks = list(tasks)
+    results = [None] * len(tasks)
+    errors = [None] * len(tasks)
+    state = {'running': 0, 'finished': 0}
+    changed = Condition()
+
+    def done(index, result, exception):
+        results[index], errors[index] = result, exception
+        if callable(tasks[index]):
+            state['running'] -= 1
+        state['finished'] += 1
+        changed.notify()
+
+    # running coroutines are watched at once, they may terminate before their turn
+    for index, task in enumerate(tasks):
+        if not callable(task):
+            coroutine.notify(task, functools.partial(done, index))
+    pending = [index for index, task in enumerate(tasks) if callable(task)]
+    started = 0
+    while state['finished'] < len(tasks):
+        while started < len(pending) and (limit is None or state['running'] < limit):
+            index = pending[started]
+            coroutine.notify(tasks[index](), functools.partial(done, index))
+            state['running'] += 1
+            started += 1
+        if state['finished'] < len(tasks):
+            yield from changed.wait()
+    for index, exception in enumerate(errors):
+        if exception is not None:
+            if isinstance(exception, GeneratorExit):
+                exception = CancelledError("Coroutine was closed.")
+            if not return_exceptions:
+                raise exception
+            results[index] = exception
+    return results
@@ -1,7 +1,7 @@
 """`squall.utilites`"""
 
 import logging
-from time import time as now
+from time import monotonic as now
 
 log = logging.Logger("squall")
 log.setLevel(logging.WARNING)
@@ -19,7 +19,7 @@ app = bottle.default_app()
 if __name__ == '__main__':
     import logging
     configLogger(logging.INFO)
-    squall.streamServer(wsgi(app), ("127.0.0.1", 7000), 64)
+    squall.streamServer(wsgi(app, threaded=True), ("127.0.0.1", 7000), 64)
     try:
         squall.start()
     except KeyboardInterrupt:
@@ -16,7 +16,7 @@ def hello(name=None):
 if __name__ == '__main__':
     import logging
     configLogger(logging.INFO)
-    squall.streamServer(wsgi(app), ("127.0.0.1", 7000), 64)
+    squall.streamServer(wsgi(app, threaded=True), ("127.0.0.1", 7000), 64)
     try:
         squall.start()
     except KeyboardInterrupt:
@@ -0,0 +1,68 @@
+import socket
+import asyncio
+from squall import aio
+from squall import coroutine, stream
+
+
+def test_bridge():
+    result = list()
+
+    @coroutine
+    def squall_side(value):
+        yield from coroutine.sleep(0.01)
+        awaited = yield from aio.wait(asyncio.sleep(0.01, value * 2))
+        result.append(awaited)
+        return awaited + 1
+
+    async def main():
+        handle = squall_side(20)
+        aio.serve()
+        return await aio.future(handle)
+
+    assert aio.run(main()) == 41
+    assert result == [40]
+
+
+def test_timeout():
+    result = list()
+
+    @coroutine
+    def squall_side():
+        try:
+            yield from aio.wait(asyncio.sleep(10), timeout=0.01)
+        except TimeoutError:
+            result.append('timeout')
+
+    squall_side()
+    aio.run()
+    assert result == ['timeout']
+
+
+def test_stream_with_asyncio_client():
+    @stream
+    def echo(address):
+        while True:
+            data = yield from stream.readLine(timeout=1.0)
+            if not data:
+                break
+            yield from stream.write(data)
+
+    async def main():
+        server_socket, client_socket = socket.socketpair()
+        echo(server_socket, 'pair')
+        aio.serve()
+        reader, writer = await asyncio.open_connection(sock=client_socket)
+        lines = list()
+        for line in (b'Hello\n', b'World\n'):
+            writer.write(line)
+            lines.append(await reader.readline())
+        writer.close()
+        return lines
+
+    assert aio.run(main()) == [b'Hello\n', b'World\n']
+
+
+if __name__ == '__main__':
+    test_bridge()
+    test_timeout()
+    test_stream_with_asyncio_client()
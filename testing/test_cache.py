@@ -0,0 +1,66 @@
+import time
+import socket
+import threading
+import squall
+from squall.cache import ResponseCache
+from squall.scgi2wsgi import wsgi
+from test_scgi2wsgi import scgi_request, client
+
+
+def serve(application, requests, **kwargs):
+    result = list()
+    threads = list()
+    gateway = wsgi(application, **kwargs)
+    for request in requests:
+        server_socket, client_socket = socket.socketpair()
+        thread = threading.Thread(target=client, args=(client_socket, request, result))
+        thread.start()
+        threads.append(thread)
+        gateway(server_socket, 'pair')
+    squall.start()
+    for thread in threads:
+        thread.join()
+    return result
+
+
+def test_ttl_and_lru():
+    cache = ResponseCache(max_size=250, ttl=10, max_entry_size=100)
+    assert cache.put('a', [('Status', '200 OK')], b'a' * 100)
+    assert not cache.put('b', [('Status', '200 OK')], b'b' * 101)
+    assert not cache.put('b', [('Status', '500 Error')], b'b')
+    assert not cache.put('b', [('Status', '200 OK'), ('Cache-Control', 'no-store')], b'b')
+    assert not cache.put('b', [('Status', '200 OK'), ('Set-Cookie', 'id=1')], b'b')
+    assert cache.put('b', [('Status', '200 OK')], b'b' * 100)
+    assert cache.get('a') == b'a' * 100
+    assert cache.put('c', [('Status', '200 OK'), ('Cache-Control', 'public, max-age=0')], b'c') is False
+    assert cache.put('c', [('Status', '200 OK'), ('Cache-Control', 'max-age=1')], b'c' * 100)
+    # the least recently used 'b' is evicted
+    assert cache.get('b') is None and cache.get('a') and cache.get('c')
+    assert len(cache) == 2 and cache.size == 200
+    assert ResponseCache()._ttl([('Status', '200 OK')]) is None
+
+
+def test_collapsing():
+    calls = list()
+
+    def application(environ, start_response):
+        calls.append(environ['QUERY_STRING'])
+        time.sleep(0.05)
+        start_response("200 OK", [("Content-Type", "text/plain"), ("Cache-Control", "max-age=60")])
+        return [b'computed ', environ['QUERY_STRING'].encode()]
+
+    cache = ResponseCache()
+    requests = [scgi_request({'REQUEST_METHOD': 'GET', 'REQUEST_URI': '/', 'QUERY_STRING': 'q=1'})] * 5
+    requests += [scgi_request({'REQUEST_METHOD': 'POST', 'REQUEST_URI': '/', 'QUERY_STRING': 'q=1'})]
+    result = serve(application, requests, threaded=True, cache=cache)
+    expected = b'Status: 200 OK\r\nContent-Type: text/plain\r\nCache-Control: max-age=60\r\n\r\ncomputed q=1'
+    assert result == [expected] * 6
+    assert calls == ['q=1', 'q=1']
+    result = serve(application, requests[:1], threaded=True, cache=cache)
+    assert result == [expected] and len(calls) == 2
+    assert cache.hits == 1 and cache.collapsed == 4
+
+
+if __name__ == '__main__':
+    test_ttl_and_lru()
+    test_collapsing()
@@ -0,0 +1,111 @@
+import os
+import time
+import socket
+import hashlib
+import threading
+import squall
+from squall import coroutine
+
+
+def test_run_in_executor():
+    result = list()
+
+    def blocking(value):
+        time.sleep(0.1)
+        return value, threading.current_thread().name
+
+    @coroutine
+    def offload():
+        value, thread_name = yield from coroutine.run_in_executor(blocking, 42)
+        result.append((value, thread_name.startswith('squall')))
+
+    @coroutine
+    def ticker():
+        for _ in range(5):
+            yield from coroutine.sleep(0.01)
+            result.append('tick')
+
+    offload()
+    ticker()
+    squall.start()
+    assert result == ['tick'] * 5 + [(42, True)]
+
+
+def test_executor_exception():
+    result = list()
+
+    @coroutine
+    def offload():
+        try:
+            yield from coroutine.run_in_executor(int, 'NaN')
+        except ValueError:
+            result.append('raised')
+
+    offload()
+    squall.start()
+    assert result == ['raised']
+
+
+def digest(data, repeat):
+    time.sleep(0.1)
+    return type(data).__name__, hashlib.sha256(data).hexdigest(), bytes(data[:1]) * repeat
+
+
+def open_files():
+    return [os.readlink('/proc/self/fd/' + fd) for fd in os.listdir('/proc/self/fd')
+            if os.path.exists('/proc/self/fd/' + fd)]
+
+
+def test_run_in_process():
+    result = list()
+    large = os.urandom(1024*1024)
+    segments = set(name for name in os.listdir('/dev/shm') if name.startswith('psm_'))
+
+    @coroutine
+    def offload():
+        # large buffers pass through shared memory in both directions
+        kind, value, echo = yield from coroutine.run_in_process(digest, large, 100000)
+        result.append((kind, value == hashlib.sha256(large).hexdigest(), echo == large[:1] * 100000))
+        result.append((yield from coroutine.run_in_process(digest, b'small', 2))[::2])
+        try:
+            yield from coroutine.run_in_process(int, 'NaN')
+        except ValueError:
+            result.append('raised')
+
+    @coroutine
+    def ticker():
+        for _ in range(5):
+            yield from coroutine.sleep(0.01)
+            result.append('tick')
+
+    offload()
+    ticker()
+    squall.start()
+    assert result == ['tick'] * 5 + [('memoryview', True, True), ('bytes', b'ss'), 'raised']
+    assert set(name for name in os.listdir('/dev/shm') if name.startswith('psm_')) == segments
+
+
+def test_process_isolation():
+    result = list()
+    listener = socket.socket()
+    listener.listen(1)
+    name = 'socket:[{}]'.format(os.fstat(listener.fileno()).st_ino)
+
+    @coroutine
+    def offload():
+        result.extend((yield from coroutine.run_in_process(open_files)))
+
+    try:
+        offload()
+        squall.start()
+    finally:
+        listener.close()
+    # workers do not inherit sockets of the server
+    assert result and name not in result
+
+
+if __name__ == '__main__':
+    test_run_in_executor()
+    test_executor_exception()
+    test_run_in_process()
+    test_process_isolation()
@@ -1,5 +1,6 @@
+import socket
 from time import time
-from squall.dispatcher import dispatcher, Dispatcher, TIMEOUT
+from squall.dispatcher import dispatcher, Dispatcher, READ, WRITE, TIMEOUT, HIGH, NORMAL, LOW
 
 
 def test_singleton():
@@ -22,7 +23,141 @@ def test_timeouts():
     assert result == [(0.1, TIMEOUT), (0.3, TIMEOUT), (0.5, TIMEOUT)]
 
 
+def test_cancel():
+    result = list()
+    dispatcher = Dispatcher()
+    timers = [dispatcher.watch(lambda ev, n=n: result.append(n), timeout=0.01 + (n % 7) * 0.001)
+              for n in range(1000)]
+    for timer in timers[1::2]:
+        dispatcher.cancel(timer)
+    dispatcher.start()
+    assert sorted(result) == list(range(0, 1000, 2))
+    # the singleton may keep tombstones of other tests, only the own timers are checked
+    assert not any(timer in dispatcher._timeouts for timer in timers)
+    assert dispatcher._cancelled == sum(1 for timer in dispatcher._timeouts if timer[2] is None)
+
+
+def test_cancel_within_batch():
+    result = list()
+    dispatcher = Dispatcher()
+
+    def first(revents):
+        # cancels the rest of its own batch, enough to compact the heap
+        for timer in batch[1:]:
+            dispatcher.cancel(timer)
+        result.append('first')
+
+    batch = [dispatcher.watch(first, timeout=0.01)]
+    batch += [dispatcher.watch(lambda ev: result.append('cancelled'), timeout=0.01) for _ in range(299)]
+    later = [dispatcher.watch(lambda ev: result.append('later'), timeout=0.05) for _ in range(300)]
+    for _ in range(1000):
+        if not dispatcher.active:
+            break
+        dispatcher.loop()
+    assert not dispatcher.active
+    assert result == ['first'] + ['later'] * 300
+    assert not any(timer in dispatcher._timeouts for timer in batch + later)
+    assert dispatcher._cancelled == sum(1 for timer in dispatcher._timeouts if timer[2] is None)
+
+
+def test_oneshot_rearm():
+    result = list()
+    sock_a, sock_b = socket.socketpair()
+    dispatcher = Dispatcher()
+    dispatcher.watch(result.append, sock_a.fileno(), READ, timeout=0.1)
+    dispatcher.start()
+    sock_b.send(b'x')
+    dispatcher.watch(result.append, sock_a.fileno(), READ, timeout=0.1)
+    dispatcher.start()
+    assert result == [TIMEOUT, READ]
+    dispatcher.release(sock_a.fileno())
+    sock_a.close()
+    sock_b.close()
+
+
+def test_tracked_readiness():
+    result = list()
+    sock_a, sock_b = socket.socketpair()
+    dispatcher = Dispatcher()
+    dispatcher.track(sock_a.fileno())
+    dispatcher.watch(result.append, sock_a.fileno(), READ, timeout=0.1)
+    dispatcher.start()
+    sock_b.send(b'x')
+    dispatcher.watch(result.append, sock_a.fileno(), WRITE)
+    dispatcher.start()
+    # readiness has been tracked while nobody was waiting for it
+    dispatcher.watch(result.append, sock_a.fileno(), READ)
+    dispatcher.start()
+    assert result == [TIMEOUT, WRITE, READ]
+    dispatcher.release(sock_a.fileno())
+    sock_a.close()
+    sock_b.close()
+
+
+def test_track_reused_fd():
+    result = list()
+    dispatcher = Dispatcher()
+    sock_a, sock_b = socket.socketpair()
+    fd = sock_a.fileno()
+    dispatcher.watch(result.append, fd, READ, timeout=0.01)
+    dispatcher.start()
+    # closed without release, its number goes to the next socket
+    sock_a.close()
+    sock_b.close()
+    sock_a, sock_b = socket.socketpair()
+    assert sock_a.fileno() == fd
+    dispatcher.track(fd)
+    sock_b.send(b'x')
+    dispatcher.watch(result.append, fd, READ, timeout=0.1)
+    dispatcher.start()
+    assert result == [TIMEOUT, READ]
+    dispatcher.release(fd)
+    sock_a.close()
+    sock_b.close()
+
+
+def test_priorities():
+    result = list()
+    for n in range(1000):
+        dispatcher.call(lambda ev, n=n: result.append(('low', n)), LOW)
+    for n in range(1000):
+        dispatcher.call(lambda ev, n=n: result.append(('high', n)), HIGH)
+    dispatcher.call(lambda ev: result.append(('normal', 0)))
+    dispatcher.loop(block=False)
+    # the budget holds the most of queued callbacks back, but every class has its share
+    assert len(result) <= dispatcher.callback_budget + 2 * dispatcher.min_share
+    assert result[0] == ('high', 0)
+    assert ('normal', 0) in result
+    assert [item for item in result if item[0] == 'low'] == [('low', n) for n in range(dispatcher.min_share)]
+    while dispatcher.active:
+        dispatcher.loop(block=False)
+    assert sorted(result) == sorted([('high', n) for n in range(1000)] + [('low', n) for n in range(1000)]
+                                    + [('normal', 0)])
+
+
+
+def test_queued_within_iteration():
+    result = list()
+
+    def high(ev):
+        result.append('high')
+        dispatcher.call(lambda ev: result.append('normal'), NORMAL)
+        dispatcher.call(lambda ev: result.append('low'), LOW)
+
+    dispatcher.call(high, HIGH)
+    dispatcher.loop(block=False)
+    # callbacks queued in this iteration run in the next one, whatever their class
+    assert result == ['high']
+    dispatcher.loop(block=False)
+    assert result == ['high', 'normal', 'low']
 
 if __name__ == '__main__':
     test_singleton()
     test_timeouts()
+    test_cancel()
+    test_cancel_within_batch()
+    test_oneshot_rearm()
+    test_tracked_readiness()
+    test_track_reused_fd()
+    test_priorities()
+    test_queued_within_iteration()
@@ -0,0 +1,241 @@
+import io
+import time
+import socket
+import tempfile
+import threading
+import squall
+from squall import coroutine, stream
+from squall.network import drain
+from squall.utilites import log
+from squall.http2wsgi import wsgi
+
+
+def client(sock, request, result):
+    with sock:
+        sock.sendall(request)
+        sock.shutdown(socket.SHUT_WR)
+        data = b''
+        while True:
+            received = sock.recv(65536)
+            if not received:
+                break
+            data += received
+        result.append(data)
+
+
+def communicate(application, request, **kwargs):
+    result = list()
+    server_socket, client_socket = socket.socketpair()
+    thread = threading.Thread(target=client, args=(client_socket, request, result))
+    thread.start()
+    wsgi(application, **kwargs)(server_socket, ('127.0.0.1', 12345))
+    squall.start()
+    thread.join()
+    return result[0]
+
+
+def application(environ, start_response):
+    body = environ['wsgi.input'].read()
+    if environ['PATH_INFO'] == '/length':
+        start_response("200 OK", [("Content-Length", str(len(body)))])
+        return [body]
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [environ['PATH_INFO'].encode(), b'?', environ['QUERY_STRING'].encode(), body]
+
+
+def test_pipelining():
+    request = (b'GET /first?a=1 HTTP/1.1\r\nHost: localhost\r\n\r\n'
+               b'POST /length HTTP/1.1\r\nHost: localhost\r\nContent-Length: 5\r\n\r\nHello'
+               b'GET /last HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n')
+    response = communicate(application, request)
+    assert response == (b'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nTransfer-Encoding: chunked\r\n\r\n'
+                        b'6\r\n/first\r\n1\r\n?\r\n3\r\na=1\r\n0\r\n\r\n'
+                        b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nHello'
+                        b'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nTransfer-Encoding: chunked\r\n'
+                        b'Connection: close\r\n\r\n5\r\n/last\r\n1\r\n?\r\n0\r\n\r\n')
+
+
+def test_pipelining_without_blocking():
+    def application(environ, start_response):
+        if environ['PATH_INFO'] == '/slow':
+            time.sleep(0.5)
+        body = environ['PATH_INFO'].encode()
+        start_response("200 OK", [("Content-Length", str(len(body)))])
+        return [body]
+
+    def pipelining_client(sock, first, rest, result):
+        # waits for the first response before it sends the rest of the next request
+        with sock:
+            sock.settimeout(2.0)
+            sock.sendall(first)
+            data = b''
+            while b'/fast' not in data:
+                data += sock.recv(65536)
+            result.append(time.monotonic() - started)
+            sock.sendall(rest)
+            while not data.endswith(b'/slow'):
+                received = sock.recv(65536)
+                if not received:
+                    break
+                data += received
+
+    fast = b'GET /fast HTTP/1.1\r\nHost: localhost\r\n\r\n'
+    slow = b'GET /slow HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'
+    for first, rest, threaded in ((fast + slow[:20], slow[20:], False), (fast + slow, b'', True)):
+        result = list()
+        server_socket, client_socket = socket.socketpair()
+        thread = threading.Thread(target=pipelining_client, args=(client_socket, first, rest, result))
+        started = time.monotonic()
+        thread.start()
+        wsgi(application, threaded=threaded)(server_socket, ('127.0.0.1', 12345))
+        squall.start()
+        thread.join()
+        # the finished response goes out while the next request is incomplete or slow
+        assert len(result) == 1 and result[0] < 0.3
+
+
+def test_keep_alive_close_with_header_timeout():
+    errors = list()
+    original, log.exception = log.exception, errors.append
+    try:
+        request = b'GET /first HTTP/1.1\r\nHost: localhost\r\n\r\n'
+        response = communicate(application, request, header_timeout=1.0)
+    finally:
+        log.exception = original
+    # the client closes the keep-alive connection after the response
+    assert response.startswith(b'HTTP/1.1 200 OK\r\n')
+    assert errors == []
+
+
+def test_close_without_body():
+    def application(environ, start_response):
+        start_response("200 OK", [("Content-Length", "0"), ("Connection", "close")])
+        return iter([])
+
+    request = (b'GET /first HTTP/1.1\r\nHost: localhost\r\n\r\n'
+               b'GET /second HTTP/1.1\r\nHost: localhost\r\n\r\n')
+    response = communicate(application, request, threaded=True)
+    # the pipelined request is not served after "Connection: close"
+    assert response == b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+
+
+def test_chunked_request():
+    request = (b'POST /length HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+               b'5\r\nHello\r\n7;ext=1\r\n, World\r\n0\r\n\r\n')
+    response = communicate(application, request)
+    assert response == b'HTTP/1.1 200 OK\r\nContent-Length: 12\r\n\r\nHello, World'
+
+
+def test_http10():
+    request = b'GET /old HTTP/1.0\r\n\r\n'
+    response = communicate(application, request)
+    assert response == (b'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n'
+                        b'Connection: close\r\n\r\n/old?')
+
+
+def test_bad_request():
+    response = communicate(application, b'GARBAGE\r\n\r\n')
+    assert response.startswith(b'HTTP/1.1 400 Bad Request\r\n')
+
+
+def test_file_wrapper():
+    def application(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        if environ['PATH_INFO'] == '/memory':
+            return environ['wsgi.file_wrapper'](io.BytesIO(b'in memory'))
+        file = tempfile.TemporaryFile()
+        file.write(b'on disk')
+        file.seek(0)
+        return environ['wsgi.file_wrapper'](file)
+
+    request = (b'GET /disk HTTP/1.1\r\n\r\n'
+               b'GET /memory HTTP/1.1\r\n\r\n')
+    response = communicate(application, request)
+    assert response == (b'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nTransfer-Encoding: chunked\r\n\r\n'
+                        b'7\r\non disk\r\n0\r\n\r\n'
+                        b'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nTransfer-Encoding: chunked\r\n\r\n'
+                        b'9\r\nin memory\r\n0\r\n\r\n')
+
+
+def test_drain():
+    def application(environ, start_response):
+        if environ['PATH_INFO'] == '/slow':
+            time.sleep(0.2)
+        start_response("200 OK", [("Content-Length", "2")])
+        return [b'OK']
+
+    def keep_alive_client(sock, request, result):
+        with sock:
+            sock.sendall(request)
+            data = b''
+            while True:
+                received = sock.recv(65536)
+                if not received:
+                    break
+                data += received
+            result.append(data)
+
+    @coroutine
+    def drainer():
+        yield from coroutine.sleep(0.1)
+        drain(deadline=5.0)
+
+    result = list()
+    threads = list()
+    served = wsgi(application, threaded=True)
+    for path in ('/idle', '/slow'):
+        server_socket, client_socket = socket.socketpair()
+        request = 'GET {} HTTP/1.1\r\nHost: localhost\r\n\r\n'.format(path).encode()
+        threads.append(threading.Thread(target=keep_alive_client, args=(client_socket, request, result)))
+        threads[-1].start()
+        served(server_socket, ('127.0.0.1', 12345))
+    drainer()
+    started = time.monotonic()
+    squall.start()
+    for thread in threads:
+        thread.join()
+    assert time.monotonic() - started < 1.0
+    # the idle keep-alive connection is closed at once, the busy one after its response
+    assert sorted(result) == [b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nOK',
+                              b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: close\r\n\r\nOK']
+
+
+def test_header_deadline():
+    def slowloris(sock, result):
+        with sock:
+            try:
+                for char in b'GET / HTTP/1.1\r\nHost: localhost\r\n' * 10:
+                    sock.sendall(bytes([char]))
+                    time.sleep(0.02)
+            except OSError:
+                pass
+            result.append(sock.recv(1024))
+
+    result = list()
+    server_socket, client_socket = socket.socketpair()
+    thread = threading.Thread(target=slowloris, args=(client_socket, result))
+    thread.start()
+    interval, stream.reap_interval = stream.reap_interval, 0.05
+    try:
+        wsgi(application, header_timeout=0.2)(server_socket, ('127.0.0.1', 12345))
+        started = time.monotonic()
+        squall.start()
+    finally:
+        stream.reap_interval = interval
+    thread.join()
+    # the connection is closed without response, however often the client sends
+    assert time.monotonic() - started < 0.5
+    assert result == [b'']
+
+
+if __name__ == '__main__':
+    test_pipelining()
+    test_pipelining_without_blocking()
+    test_keep_alive_close_with_header_timeout()
+    test_close_without_body()
+    test_chunked_request()
+    test_http10()
+    test_bad_request()
+    test_file_wrapper()
+    test_drain()
+    test_header_deadline()
@@ -0,0 +1,372 @@
+import os
+import sys
+import stat
+import time
+import socket
+import tempfile
+import tracemalloc
+import threading
+import squall
+from squall import coroutine, stream, streamServer
+from squall import stats
+from squall import network
+from squall.dispatcher import dispatcher
+
+SUCCESSOR = """
+import squall
+from squall import stream, streamServer
+
+@stream
+def echo(address):
+    data = yield from stream.readLine(timeout=1.0)
+    yield from stream.write(b'new ' + data)
+    squall.stop()
+
+assert streamServer(echo, ('127.0.0.1', 0), 16)
+squall.start()
+"""
+
+
+def client(sock, lines, result):
+    with sock:
+        for line in lines:
+            sock.sendall(line)
+            data = b''
+            while not data.endswith(b'\n'):
+                data += sock.recv(1024)
+            result.append(data)
+        sock.shutdown(socket.SHUT_WR)
+
+
+def test_echo():
+    @stream
+    def echo(address):
+        while True:
+            data = yield from stream.readLine(timeout=1.0)
+            if not data:
+                break
+            yield from stream.write(data)
+
+    result = list()
+    lines = [b'Hello\n', b'World!\n', b'x' * 10000 + b'\n']
+    server_socket, client_socket = socket.socketpair()
+    thread = threading.Thread(target=client, args=(client_socket, lines, result))
+    thread.start()
+    echo(server_socket, 'pair')
+    squall.start()
+    thread.join()
+    assert result == lines
+
+
+def test_read_into():
+    result = list()
+
+    @stream
+    def reader(address):
+        buffer = bytearray(100000)
+        header = yield from stream.readLine()
+        number = yield from stream.read_into(buffer)
+        result.append((header, bytes(buffer[:number])))
+
+    payload = bytes(range(256)) * 300
+    server_socket, client_socket = socket.socketpair()
+    thread = threading.Thread(target=lambda: (client_socket.sendall(b'head\n' + payload),
+                                              client_socket.close()))
+    thread.start()
+    reader(server_socket, 'pair')
+    squall.start()
+    thread.join()
+    assert result == [(b'head\n', payload)]
+
+
+def test_buffer():
+    def fill(buffer, data):
+        view = buffer.tail(len(data))
+        view[:len(data)] = data[:len(view)]
+        buffer.commit(len(view))
+        return len(view)
+
+    buffer = network.Buffer(64)
+    # an empty buffer holds no storage
+    assert buffer.size == 64 and not len(buffer._data)
+    fill(buffer, b'Hello')
+    assert len(buffer._data) == 5
+    fill(buffer, b', World!')
+    assert buffer.read(7) == b'Hello, '
+    # it grows up to size
+    assert fill(buffer, b'x' * 100) == 64 - len(b'World!')
+    assert len(buffer._data) == 64 and len(buffer) == 64
+    assert buffer.read(6) == b'World!'
+    # and is released once drained
+    assert buffer.read() == b'x' * 58
+    assert not len(buffer._data)
+    tracemalloc.start()
+    try:
+        states = [network.StreamState(None, 4*1024, 256*1024) for _ in range(1000)]
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # a state of an idle stream costs less than a chunk
+    assert len(states) == 1000 and size < 1000 * 2*1024
+
+
+class Sender(object):
+    """Socket stub, sends at most limit bytes in a call of sendmsg."""
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.calls = list()
+
+    def sendmsg(self, buffers):
+        data = b''.join(bytes(buffer) for buffer in buffers)
+        data = data[:self.limit]
+        self.calls.append(data)
+        return len(data)
+
+
+def complete(corogen):
+    # runs a generator of the stream API that must not wait
+    try:
+        next(corogen)
+    except StopIteration as exc:
+        return exc.value
+    assert False, "Must not wait."
+
+
+def test_write_queue():
+    instance = network.StreamState(Sender(), 1024, 1024)
+    data = bytearray(b'World')
+    assert complete(stream._write(instance, b'Hello, ', flush=False)) == 7
+    assert complete(stream._write(instance, data, flush=False)) == 5
+    data[:] = b'xxxxx'
+    assert instance.out_queued == 12 and not instance.socket.calls
+    # all queued buffers go out in one call
+    complete(stream._write(instance, b'!'))
+    assert instance.socket.calls == [b'Hello, World!']
+    assert instance.out_queued == 0 and not instance.out_queue
+    # the queue is flushed when it reaches buffer size
+    instance = network.StreamState(Sender(), 1024, 16)
+    complete(stream._write(instance, b'x' * 10, flush=False))
+    complete(stream._write(instance, b'y' * 10, flush=False))
+    assert instance.socket.calls == [b'x' * 10 + b'y' * 10]
+    # the remainder of a partially sent buffer is sent by the next call
+    instance = network.StreamState(Sender(10), 1024, 1024)
+    complete(stream._write(instance, b'Hello, ', flush=False))
+    complete(stream._write(instance, b'World!'))
+    assert instance.socket.calls == [b'Hello, Wor', b'ld!']
+    assert instance.out_queued == 0 and not instance.out_queue
+
+
+def test_socket_options():
+    @stream
+    def options(address):
+        sock = stream._socket
+        for name in ('TCP_CORK', 'TCP_NODELAY'):
+            option = getattr(socket, name)
+            setter = stream.setCork if name == 'TCP_CORK' else stream.setNoDelay
+            for value in (True, False):
+                assert setter(value)
+                result.append((name, value, bool(sock.getsockopt(socket.IPPROTO_TCP, option))))
+
+    result = list()
+    with socket.create_server(('127.0.0.1', 0)) as listener:
+        with socket.create_connection(listener.getsockname()):
+            server_socket, _ = listener.accept()
+            options(server_socket, 'tcp')
+            squall.start()
+    assert result == [('TCP_CORK', True, True), ('TCP_CORK', False, False),
+                      ('TCP_NODELAY', True, True), ('TCP_NODELAY', False, False)]
+
+
+def test_max_connections():
+    active = list()
+    served = list()
+
+    @stream
+    def echo(address):
+        active.append(address)
+        served.append(len(active))
+        yield from coroutine.sleep(0.02)
+        data = yield from stream.readLine(timeout=1.0)
+        yield from stream.write(data)
+        active.remove(address)
+        if len(served) == 8:
+            squall.stop()
+
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    streamServer(echo, ('127.0.0.1', port), 16, max_connections=2)
+    result = list()
+    clients = [socket.create_connection(('127.0.0.1', port)) for _ in range(8)]
+    threads = [threading.Thread(target=client, args=(sock, [b'ping\n'], result)) for sock in clients]
+    for thread in threads:
+        thread.start()
+    squall.start()
+    for thread in threads:
+        thread.join()
+    assert result == [b'ping\n'] * 8
+    assert max(served) == 2
+
+
+def test_unix_and_inherited_listeners():
+    served = list()
+
+    @stream
+    def echo(address):
+        data = yield from stream.readLine(timeout=1.0)
+        yield from stream.write(data)
+        served.append(address)
+        if len(served) == 2:
+            squall.stop()
+
+    path = os.path.join(tempfile.mkdtemp(), 'app.sock')
+    # a stale socket file is removed
+    stale = socket.socket(socket.AF_UNIX)
+    stale.bind(path)
+    stale.close()
+    assert streamServer(echo, 'unix:' + path, 16, mode=0o600)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    inherited = socket.socket()
+    inherited.bind(('127.0.0.1', 0))
+    inherited.listen(16)
+    port = inherited.getsockname()[1]
+    assert streamServer(echo, 'fd:{}'.format(inherited.detach()), 16)
+    result = list()
+    clients = [socket.socket(socket.AF_UNIX), socket.create_connection(('127.0.0.1', port))]
+    clients[0].connect(path)
+    threads = [threading.Thread(target=client, args=(sock, [b'ping\n'], result)) for sock in clients]
+    for thread in threads:
+        thread.start()
+    squall.start()
+    for thread in threads:
+        thread.join()
+    assert result == [b'ping\n', b'ping\n']
+    assert not os.path.exists(path)
+
+
+def test_stats():
+    stats.enable()
+    try:
+        test_echo()
+        snapshot = stats.snapshot()
+    finally:
+        stats.disable()
+    assert snapshot['bytes_read'] == snapshot['bytes_written'] == 10000 + 14
+    assert snapshot['iterations'] > 0
+    assert sum(snapshot['iteration_us']['histogram'].values()) == snapshot['iterations']
+    assert snapshot['streams'] == snapshot['coroutines'] == 0
+    assert stats.snapshot() is None
+
+
+def test_stats_callbacks():
+    result = list()
+    for n in range(1000):
+        dispatcher.call(lambda ev, n=n: result.append(n))
+    stats.enable()
+    try:
+        dispatcher.loop(block=False)
+        snapshot, executed = stats.snapshot(), len(result)
+        while dispatcher.active:
+            dispatcher.loop(block=False)
+    finally:
+        stats.disable()
+    # callbacks held back by the budget are not counted until they are executed
+    assert 0 < executed < 1000 and len(result) == 1000
+    assert snapshot['callbacks'] == snapshot['max_callbacks'] == executed + snapshot['events']
+    assert snapshot['max_idles'] == 1000 and snapshot['idles'] == 1000 - executed
+
+
+def test_reload():
+    @stream
+    def echo(address):
+        data = yield from stream.readLine(timeout=1.0)
+        yield from coroutine.sleep(0.2)
+        yield from stream.write(b'old ' + data)
+
+    @coroutine
+    def reloader():
+        yield from coroutine.sleep(0.05)
+        pids.append(network.reload(deadline=5.0, args=[sys.executable, '-c', SUCCESSOR]))
+
+    pids = list()
+    handles = streamServer(echo, ('127.0.0.1', 0), 16)
+    port = network._listeners[handles[0]][1].getsockname()[1]
+    result = list()
+    thread = threading.Thread(target=client, args=(socket.create_connection(('127.0.0.1', port)),
+                                                    [b'ping\n'], result))
+    thread.start()
+    reloader()
+    started = time.monotonic()
+    squall.start()
+    thread.join()
+    # the in-flight request has been finished before exit
+    assert result == [b'old ping\n']
+    assert time.monotonic() - started < 1.0
+    assert not network._listeners and not stream.draining
+    # the listener is served by the successor without a gap
+    client(socket.create_connection(('127.0.0.1', port)), [b'ping\n'], result)
+    assert result == [b'old ping\n', b'new ping\n']
+    assert os.waitpid(pids[0], 0)[1] == 0
+
+
+def test_idle_timeout_and_deadline():
+    reaped = dict()
+
+    @stream(idle_timeout=0.2)
+    def idle(address):
+        try:
+            while (yield from stream.readLine(timeout=5.0)):
+                pass
+        except TimeoutError:
+            reaped[address] = time.monotonic() - started
+
+    @stream
+    def trickled(address):
+        stream.setDeadline(0.3)
+        try:
+            while (yield from stream.read(1, timeout=5.0)):
+                pass
+        except TimeoutError:
+            reaped[address] = time.monotonic() - started
+
+    def slow_client(sock, delay):
+        # a byte every delay seconds until the server closes the connection
+        with sock:
+            try:
+                for _ in range(100):
+                    sock.sendall(b'x\n')
+                    time.sleep(delay)
+            except OSError:
+                pass
+
+    interval, stream.reap_interval = stream.reap_interval, 0.05
+    try:
+        threads = list()
+        for coroinst, address, delay in ((idle, 'idle', 5.0), (trickled, 'trickled', 0.05)):
+            server_socket, client_socket = socket.socketpair()
+            threads.append(threading.Thread(target=slow_client, args=(client_socket, delay), daemon=True))
+            threads[-1].start()
+            coroinst(server_socket, address)
+        started = time.monotonic()
+        squall.start()
+    finally:
+        stream.reap_interval = interval
+    assert sorted(reaped) == ['idle', 'trickled']
+    assert 0.2 <= reaped['idle'] < 0.5
+    # the deadline holds however often the client sends
+    assert 0.3 <= reaped['trickled'] < 0.6
+    assert not stream._limited and stream._reaper is None
+
+
+if __name__ == '__main__':
+    test_echo()
+    test_stats()
+    test_stats_callbacks()
+    test_read_into()
+    test_buffer()
+    test_write_queue()
+    test_socket_options()
+    test_max_connections()
+    test_unix_and_inherited_listeners()
+    test_reload()
+    test_idle_timeout_and_deadline()
@@ -0,0 +1,71 @@
+import errno
+import socket
+import squall
+from squall import coroutine, stream, streamServer
+from squall.pool import ConnectionPool
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def test_pool():
+    accepted = list()
+    result = list()
+
+    @stream
+    def echo(address):
+        accepted.append(address)
+        while True:
+            data = yield from stream.readLine(timeout=1.0)
+            if not data:
+                break
+            yield from stream.write(data)
+
+    @coroutine
+    def client(pool, number):
+        connection = yield from pool.acquire(timeout=1.0)
+        try:
+            yield from connection.write(b'request %d\n' % number)
+            result.append((yield from connection.readLine(timeout=1.0)))
+        finally:
+            pool.release(connection)
+
+    @coroutine
+    def main(pool):
+        handles = [client(pool, number) for number in range(5)]
+        while any(handle in coroutine.all for handle in handles):
+            yield from coroutine.sleep(0.01)
+        assert len(pool) == pool.idle == 2
+        yield from coroutine.sleep(0.15)
+        assert len(pool) == pool.idle == 0
+        squall.stop()
+
+    port = free_port()
+    streamServer(echo, ('127.0.0.1', port), 16)
+    main(ConnectionPool(('127.0.0.1', port), max_size=2, idle_timeout=0.1))
+    squall.start()
+    assert sorted(result) == [b'request %d\n' % number for number in range(5)]
+    assert len(accepted) == 2
+
+
+def test_connect_refused():
+    result = list()
+
+    @coroutine
+    def main():
+        try:
+            yield from stream.connect(('127.0.0.1', free_port()), timeout=1.0)
+        except OSError as exc:
+            result.append(exc.errno)
+
+    main()
+    squall.start()
+    assert result == [errno.ECONNREFUSED]
+
+
+if __name__ == '__main__':
+    test_pool()
+    test_connect_refused()
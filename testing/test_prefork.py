@@ -0,0 +1,70 @@
+import os
+import sys
+import select
+import signal
+import time
+import subprocess
+
+SUPERVISED = """
+import os
+import squall
+from squall import coroutine
+
+@coroutine
+def announce():
+    os.write(1, b'%d\\n' % os.getpid())
+    while True:
+        yield from coroutine.sleep(1.0)
+
+announce()
+squall.start(workers=2)
+"""
+
+
+class Pids(object):
+    """Reads pids announced by workers from the pipe."""
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.lines = list()
+        self.buffer = b''
+
+    def next(self, timeout=5.0):
+        while not self.lines:
+            ready, _, _ = select.select([self.pipe], [], [], timeout)
+            assert ready, "Worker has not started."
+            chunk = os.read(self.pipe.fileno(), 4096)
+            assert chunk, "Supervisor has exited."
+            *lines, self.buffer = (self.buffer + chunk).split(b'\n')
+            self.lines.extend(int(line) for line in lines)
+        return self.lines.pop(0)
+
+
+def test_supervisor():
+    process = subprocess.Popen([sys.executable, '-c', SUPERVISED], stdout=subprocess.PIPE)
+    try:
+        pids = Pids(process.stdout)
+        workers = [pids.next(), pids.next()]
+        assert len(set(workers)) == 2
+        # a killed worker is respawned
+        os.kill(workers[0], signal.SIGKILL)
+        respawned = pids.next()
+        assert respawned not in workers
+        # lets the respawned worker reach its loop
+        time.sleep(0.1)
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(5.0) == 0
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+    # all workers have been finished and reaped by the supervisor
+    for pid in workers[1:] + [respawned]:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            continue
+        assert False, "Worker {} is still running.".format(pid)
+
+
+if __name__ == '__main__':
+    test_supervisor()
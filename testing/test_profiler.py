@@ -0,0 +1,77 @@
+import time
+import squall
+from squall import coroutine
+from squall import profiler
+
+
+def test_profiler():
+    warnings = list()
+
+    @coroutine
+    def busy(steps):
+        for _ in range(steps):
+            sum(range(20000))
+            yield from coroutine.sleep(0.001)
+
+    @coroutine
+    def blocker():
+        yield from coroutine.sleep(0.001)
+        time.sleep(0.25)
+
+    @coroutine
+    def main():
+        handle = busy(100)
+        busy(5)
+        blocker()
+        yield from coroutine.sleep(0.05)
+        report = profiler.report()
+        warnings.append(report)
+        assert report['coroutines'][0]['handle'] == handle
+        yield from coroutine.sleep(0.6)
+        squall.stop()
+
+    original, profiler.log.warning = profiler.log.warning, warnings.append
+    profiler.enable(threshold=0.1)
+    try:
+        main()
+        squall.start()
+        report = profiler.report()
+    finally:
+        profiler.disable()
+        profiler.log.warning = original
+    assert profiler.report() is None
+    # terminated coroutines are accounted only to their functions
+    assert report['coroutines'] == []
+    functions = {entry['name']: entry for entry in report['functions']}
+    assert functions['test_profiler.<locals>.busy']['coroutines'] == 2
+    assert functions['test_profiler.<locals>.busy']['switches'] == 107
+    assert functions['test_profiler.<locals>.busy']['cpu'] > 0
+    assert functions['test_profiler.<locals>.blocker']['max_step'] >= 0.25
+    assert report['slow_steps'] == 1
+    message = [item for item in warnings if isinstance(item, str)][0]
+    # the watchdog has sampled the stack inside the blocking call
+    assert 'blocker' in message and 'time.sleep(0.25)' in message
+
+
+def test_enable_in_coroutine():
+    reports = list()
+
+    @coroutine
+    def main():
+        profiler.enable(threshold=0)
+        yield from coroutine.sleep(0.01)
+        yield from coroutine.sleep(0.01)
+        reports.append(profiler.report())
+
+    try:
+        main()
+        squall.start()
+    finally:
+        profiler.disable()
+    # the switch that has enabled the profiler is not accounted, the current one is not finished
+    assert reports[0]['coroutines'][0]['switches'] == 1
+
+
+if __name__ == '__main__':
+    test_profiler()
+    test_enable_in_coroutine()
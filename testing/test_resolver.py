@@ -0,0 +1,119 @@
+import socket
+import struct
+import tempfile
+import threading
+import squall
+from squall import coroutine
+from squall.resolver import Resolver
+
+
+def stub_server(sock, records, queries):
+    # answers A and AAAA queries from records, NXDOMAIN for unknown names
+    while True:
+        data, peer = sock.recvfrom(512)
+        if data == b'stop':
+            break
+        qid, = struct.unpack_from('!H', data)
+        offset, labels = 12, list()
+        while data[offset]:
+            labels.append(data[offset+1:offset+1+data[offset]].decode())
+            offset += data[offset] + 1
+        qtype, = struct.unpack_from('!H', data, offset + 1)
+        name = '.'.join(labels)
+        queries.append((name, qtype))
+        question = data[12:offset+5]
+        answers = [(rtype, rdata, ttl) for rtype, rdata, ttl in records.get(name, ()) if rtype == qtype]
+        rcode = 0 if name in records else 3
+        response = struct.pack('!HHHHHH', qid, 0x8180 | rcode, 1, len(answers), 0, 0) + question
+        for rtype, rdata, ttl in answers:
+            response += struct.pack('!HHHIH', 0xC00C, rtype, 1, ttl, len(rdata)) + rdata
+        sock.sendto(response, peer)
+
+
+def test_resolver():
+    records = {'backend.test': [(1, socket.inet_aton('10.0.0.7'), 60),
+                                (28, socket.inet_pton(socket.AF_INET6, 'fd00::7'), 30)]}
+    queries = list()
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server_socket.bind(('127.0.0.1', 0))
+    thread = threading.Thread(target=stub_server, args=(server_socket, records, queries))
+    thread.start()
+    hosts = tempfile.NamedTemporaryFile('w', suffix='hosts')
+    hosts.write('127.0.0.5  local.test  alias.test # comment\n')
+    hosts.flush()
+    resolver = Resolver(nameservers=[server_socket.getsockname()], hosts_path=hosts.name, timeout=1.0,
+                        search=())
+    result = list()
+
+    @coroutine
+    def main():
+        result.append((yield from resolver.getaddrinfo('backend.test', 80)))
+        result.append((yield from resolver.resolve('BACKEND.test')))
+        result.append((yield from resolver.resolve('alias.test')))
+        result.append((yield from resolver.getaddrinfo('127.0.0.1', 80, socket.AF_INET)))
+        try:
+            yield from resolver.resolve('missing.test', socket.AF_INET)
+        except socket.gaierror as exc:
+            result.append(exc.errno)
+        try:
+            yield from resolver.resolve('missing.test', socket.AF_INET)
+        except socket.gaierror as exc:
+            result.append(exc.errno)
+
+    main()
+    squall.start()
+    server_socket.sendto(b'stop', server_socket.getsockname())
+    thread.join()
+    server_socket.close()
+    assert result[0] == [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', ('10.0.0.7', 80)),
+                         (socket.AF_INET6, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', ('fd00::7', 80, 0, 0))]
+    assert result[1] == [(socket.AF_INET, '10.0.0.7'), (socket.AF_INET6, 'fd00::7')]
+    assert result[2] == [(socket.AF_INET, '127.0.0.5')]
+    assert result[3][0][4] == ('127.0.0.1', 80)
+    assert result[4] == result[5] == socket.EAI_NONAME
+    # cached answers and negative answers are not asked again
+    assert sorted(queries) == [('backend.test', 1), ('backend.test', 28), ('missing.test', 1)]
+
+
+def test_search_domains():
+    records = {'db.svc.test': [(1, socket.inet_aton('10.0.0.8'), 60)],
+               'db.test': [(1, socket.inet_aton('10.0.0.9'), 60)]}
+    queries = list()
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server_socket.bind(('127.0.0.1', 0))
+    thread = threading.Thread(target=stub_server, args=(server_socket, records, queries))
+    thread.start()
+    hosts = tempfile.NamedTemporaryFile('w', suffix='hosts')
+    # the stub answers every query, so it is safe to wait without timeout
+    resolver = Resolver(nameservers=[server_socket.getsockname()], hosts_path=hosts.name, timeout=None,
+                        search=['svc.test'], ndots=2)
+    result = list()
+
+    @coroutine
+    def main():
+        result.append((yield from resolver.resolve('db', socket.AF_INET)))
+        result.append((yield from resolver.resolve('db.test', socket.AF_INET)))
+        result.append((yield from resolver.resolve('db.test.', socket.AF_INET)))
+        # the absolute name does not share the cached answer of the searched one
+        try:
+            yield from resolver.resolve('db.', socket.AF_INET)
+        except socket.gaierror as exc:
+            result.append(exc.errno)
+        # a short name unknown to nameservers is left to the system resolver
+        result.append((yield from resolver.resolve('localhost', socket.AF_INET)))
+
+    main()
+    squall.start()
+    server_socket.sendto(b'stop', server_socket.getsockname())
+    thread.join()
+    server_socket.close()
+    assert result == [[(socket.AF_INET, '10.0.0.8')], [(socket.AF_INET, '10.0.0.9')],
+                      [(socket.AF_INET, '10.0.0.9')], socket.EAI_NONAME, [(socket.AF_INET, '127.0.0.1')]]
+    # names with fewer dots than ndots are searched first, an absolute name is not searched
+    assert queries == [('db.svc.test', 1), ('db.test.svc.test', 1), ('db.test', 1), ('db.test', 1),
+                       ('db', 1), ('localhost.svc.test', 1), ('localhost', 1)]
+
+
+if __name__ == '__main__':
+    test_resolver()
+    test_search_domains()
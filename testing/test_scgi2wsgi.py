@@ -0,0 +1,166 @@
+import socket
+import tempfile
+import tracemalloc
+import threading
+import squall
+from squall.scgi2wsgi import wsgi
+
+
+def scgi_request(headers, body=b''):
+    headers = dict(headers, CONTENT_LENGTH=str(len(body)), SCGI='1')
+    header = b''.join(name.encode() + b'\0' + value.encode() + b'\0'
+                      for name, value in headers.items())
+    return str(len(header)).encode() + b':' + header + b',' + body
+
+
+def client(sock, request, result):
+    with sock:
+        sock.sendall(request)
+        sock.shutdown(socket.SHUT_WR)
+        data = b''
+        while True:
+            received = sock.recv(65536)
+            if not received:
+                break
+            data += received
+        result.append(data)
+
+
+def communicate(application, request, **kwargs):
+    result = list()
+    server_socket, client_socket = socket.socketpair()
+    thread = threading.Thread(target=client, args=(client_socket, request, result))
+    thread.start()
+    wsgi(application, **kwargs)(server_socket, 'pair')
+    squall.start()
+    thread.join()
+    head, _, body = result[0].partition(b'\r\n\r\n')
+    return head.split(b'\r\n'), body
+
+
+def test_response():
+    def application(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return [environ['PATH_INFO'].encode(), environ['wsgi.input'].read()]
+
+    request = scgi_request({'REQUEST_METHOD': 'POST', 'REQUEST_URI': '/hello'}, b'World!')
+    head, body = communicate(application, request)
+    assert head == [b'Status: 200 OK', b'Content-Type: text/plain']
+    assert body == b'/helloWorld!'
+
+
+def test_environ():
+    def application(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return [environ['HTTP_X_LARGE'][-3:].encode(), environ['wsgi.errors'].__class__.__name__.encode()]
+
+    request = scgi_request({'REQUEST_METHOD': 'GET', 'REQUEST_URI': '/', 'HTTP_X_LARGE': 'y' * 20000 + 'end'})
+    head, body = communicate(application, request, chunk_size=1024)
+    assert body == b'endErrorStream'
+    head, body = communicate(application, b'')
+    assert head == [b''] and body == b''
+
+
+def test_large_response():
+    chunks = [bytes([65 + n % 26]) * 10000 for n in range(100)]
+
+    def application(environ, start_response):
+        start_response("200 OK", [("Content-Type", "application/octet-stream")])
+        for chunk in chunks:
+            yield chunk
+
+    request = scgi_request({'REQUEST_METHOD': 'GET', 'REQUEST_URI': '/'})
+    head, body = communicate(application, request)
+    assert head[0] == b'Status: 200 OK'
+    assert body == b''.join(chunks)
+
+
+def test_threaded():
+    def application(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        yield str(environ['wsgi.multithread']).encode()
+        yield threading.current_thread().name.encode()
+
+    request = scgi_request({'REQUEST_METHOD': 'GET', 'REQUEST_URI': '/'})
+    head, body = communicate(application, request, threaded=True)
+    assert head == [b'Status: 200 OK', b'Content-Type: text/plain']
+    assert body.startswith(b'Truesquall')
+
+
+def test_streaming_input():
+    lines = [b'%06d ' % n + b'x' * 93 + b'\n' for n in range(30000)]
+
+    def application(environ, start_response):
+        input_stream = environ['wsgi.input']
+        first = input_stream.readline()
+        rest = input_stream.read(1000000)
+        rest += input_stream.read()
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return [str(len(first + rest)).encode(), b' ',
+                str(first + rest == b''.join(lines)).encode(), b' ',
+                str(input_stream._body._rolled).encode()]
+
+    request = scgi_request({'REQUEST_METHOD': 'POST', 'REQUEST_URI': '/'}, b''.join(lines))
+    head, body = communicate(application, request, threaded=True)
+    assert body == b'3030000 True True'
+    head, body = communicate(application, request)
+    assert body == b'3030000 True True'
+
+
+def test_file_wrapper():
+    content = bytes(range(256)) * 1000
+
+    def application(environ, start_response):
+        start_response("200 OK", [("Content-Type", "application/octet-stream")])
+        file = tempfile.TemporaryFile()
+        file.write(content)
+        file.seek(0)
+        if environ['PATH_INFO'] == '/range':
+            return environ['wsgi.file_wrapper'](file, offset=1000, length=5000)
+        return environ['wsgi.file_wrapper'](file)
+
+    request = scgi_request({'REQUEST_METHOD': 'GET', 'REQUEST_URI': '/'})
+    head, body = communicate(application, request)
+    assert head == [b'Status: 200 OK', b'Content-Type: application/octet-stream']
+    assert body == content
+    request = scgi_request({'REQUEST_METHOD': 'GET', 'REQUEST_URI': '/range'})
+    head, body = communicate(application, request)
+    assert body == content[1000:6000]
+
+
+def test_oversized_header():
+    def application(environ, start_response):
+        start_response("200 OK", [])
+        return [b'unreachable']
+
+    tracemalloc.start()
+    try:
+        head, body = communicate(application, b'3000000000:abc')
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # the header size is checked before any allocation
+    assert head == [b''] and body == b''
+    assert peak < 16*1024*1024
+
+
+
+def test_release_on_error():
+    def application(environ, start_response):
+        raise RuntimeError("Application failure.")
+
+    request = scgi_request({'REQUEST_METHOD': 'GET', 'REQUEST_URI': '/'})
+    for request in (b'abc:def,', b'5:A\0B\0C,', request):
+        communicate(application, request)
+    # the state of a failed request is released with its coroutine
+    assert not wsgi._state
+
+if __name__ == '__main__':
+    test_response()
+    test_environ()
+    test_large_response()
+    test_threaded()
+    test_streaming_input()
+    test_file_wrapper()
+    test_oversized_header()
+    test_release_on_error()
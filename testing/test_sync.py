@@ -0,0 +1,127 @@
+import squall
+from squall import coroutine
+from squall.sync import Event, Semaphore, Condition, Queue, join, gather
+
+
+def run(main, *args):
+    result = list()
+
+    @coroutine
+    def wrapper():
+        result.append((yield from main(*args)))
+    wrapper()
+    squall.start()
+    return result[0]
+
+
+def test_queue():
+    log = list()
+
+    @coroutine
+    def producer(queue):
+        for number in range(5):
+            yield from queue.put(number)
+            log.append(('put', number, len(queue)))
+        yield from queue.put(None)
+
+    def main():
+        queue = Queue(maxsize=2)
+        producer(queue)
+        items = list()
+        while True:
+            yield from coroutine.sleep(0.01)
+            item = yield from queue.get()
+            if item is None:
+                break
+            items.append(item)
+        try:
+            yield from queue.get(timeout=0.01)
+        except TimeoutError:
+            items.append('timeout')
+        return items
+
+    assert run(main) == [0, 1, 2, 3, 4, 'timeout']
+    assert max(size for _, _, size in log) == 2
+
+
+def test_semaphore_and_gather():
+    active = list()
+
+    @coroutine
+    def worker(semaphore, number, bound):
+        yield from semaphore.acquire()
+        try:
+            active.append(number)
+            yield from coroutine.sleep(0.01)
+            assert len(active) <= bound
+            active.remove(number)
+        finally:
+            semaphore.release()
+        return number * number
+
+    def main():
+        semaphore = Semaphore(2)
+        squares = yield from gather([worker(semaphore, number, 2) for number in range(6)])
+        tasks = [lambda n=number: worker(Semaphore(6), n, 3) for number in range(6)]
+        limited = yield from gather(tasks, limit=3)
+        return squares, limited, semaphore.value
+
+    assert run(main) == ([0, 1, 4, 9, 16, 25], [0, 1, 4, 9, 16, 25], 2)
+
+
+def test_event_condition_join():
+    @coroutine
+    def setter(event, condition, state):
+        yield from coroutine.sleep(0.01)
+        state.append(1)
+        condition.notify_all()
+        yield from coroutine.sleep(0.01)
+        event.set()
+        return 'done'
+
+    @coroutine
+    def failing():
+        yield from coroutine.sleep(0)
+        raise KeyError('failed')
+
+    def main():
+        event, condition, state = Event(), Condition(), list()
+        timed_out = yield from event.wait(0.001)
+        handle = setter(event, condition, state)
+        ready = yield from condition.wait_for(lambda: state, timeout=1.0)
+        result = yield from join(handle)
+        flag = yield from event.wait()
+        try:
+            yield from join(failing())
+        except KeyError as exc:
+            error = exc.args[0]
+        return timed_out, ready, flag, result, error
+
+    assert run(main) == (False, [1], True, 'done', 'failed')
+
+
+
+def test_join_terminated():
+    @coroutine
+    def task(number, delay):
+        yield from coroutine.sleep(delay)
+        return number
+
+    def main():
+        slow = task(0, 0.05)
+        fast = [task(number, 0) for number in range(1, 4)]
+        # fast tasks terminate while gather waits for the slow one
+        results = yield from gather([slow] + fast, limit=1)
+        try:
+            yield from join(fast[0])
+        except ValueError:
+            terminated = True
+        return results, terminated
+
+    assert run(main) == ([0, 1, 2, 3], True)
+
+if __name__ == '__main__':
+    test_queue()
+    test_semaphore_and_gather()
+    test_event_condition_join()
+    test_join_terminated()